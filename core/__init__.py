@@ -0,0 +1 @@
+# 会場ページ・pro_app 共通のデータ取得／解析ロジック
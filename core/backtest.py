@@ -0,0 +1,257 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# スタート指数のバックテスト（NumPy 一括計算）
+# ==========================================
+# 履歴を (レース数 × 6艇) の配列に並べ替え、指数の上位艇と1着艇の照合を
+# レース単位のループなしで行う。
+EVAL_MAP = {"◎": 2.0, "◯": 1.0, "△": 0.5, "×": -1.0}
+DEFAULT_PARAMS = {"w_tenji": 2.0, "w_isshu": 0.3, "eval_map": EVAL_MAP}
+
+RESULT_COLS = ["日付", "R", "指数1位", "指数2位", "指数3位", "1着艇", "1位的中", "上位2艇内", "上位3艇内"]
+
+# 払戻金の列（100円あたり、レースの全行に同じ値が入っている想定）
+PAYOUT_COLS = {"2連単": "2連単配当", "3連単": "3連単配当"}
+
+# 組番は「指数の何位の艇か」（0始まり）で表す。2連単30通り・3連単120通り
+COMBOS = {
+    "2連単": np.array(list(itertools.permutations(range(6), 2))),
+    "3連単": np.array(list(itertools.permutations(range(6), 3))),
+}
+
+# 検証する買い目（券種, 名前, ("top", 点数) または ("form", 着順ごとの指数順位の集合)）
+# "top" は全組番を指数順位の辞書順に並べた上位 N 点、"form" はフォーメーション
+BET_PLANS = [
+    ("2連単", "1点 (1-2)", ("top", 1)),
+    ("2連単", "上位3点 (1-234)", ("top", 3)),
+    ("2連単", "BOX (12)", ("form", [[0, 1], [0, 1]])),
+    ("2連単", "BOX (123)", ("form", [[0, 1, 2], [0, 1, 2]])),
+    ("3連単", "1点 (1-2-3)", ("top", 1)),
+    ("3連単", "1-23-234", ("form", [[0], [1, 2], [1, 2, 3]])),
+    ("3連単", "BOX (123)", ("form", [[0, 1, 2]] * 3)),
+    ("3連単", "1-234-234", ("form", [[0], [1, 2, 3], [1, 2, 3]])),
+    ("3連単", "上位12点", ("top", 12)),
+    ("3連単", "BOX (1234)", ("form", [[0, 1, 2, 3]] * 3)),
+]
+# ウォークフォワード検証で、窓内のレースがこれ未満の日は評価しない（立ち上がり期間）
+WALK_FORWARD_MIN_RACES = 100
+
+COMBO_RESULT_COLS = ["券種", "買い目", "点数", "検証レース数", "的中率", "回収率", "平均配当"]
+
+# 的中率の信頼区間（レース単位のブートストラップ）の引き直し回数と信頼水準
+BOOTSTRAP_RESAMPLES = 5000
+CI_LEVEL = 0.95
+
+
+def race_matrix(df):
+    # 日付・レース番号ごとに艇番1〜6が1行ずつ揃っているレースだけを (n, 6) に並べる
+    df = df[df["艇番"].between(1, 6)]
+    race_id = df.groupby(["日付", "レース番号"], sort=True).ngroup().to_numpy()
+    lane = df["艇番"].to_numpy(dtype=np.int64) - 1
+
+    n_all = race_id.max() + 1 if len(race_id) else 0
+    slot_count = np.bincount(race_id * 6 + lane, minlength=n_all * 6).reshape(n_all, 6)
+    complete = (slot_count == 1).all(axis=1)
+    new_id = np.cumsum(complete) - 1
+    keep = complete[race_id]
+    rid, ln = new_id[race_id[keep]], lane[keep]
+    n = int(complete.sum())
+
+    def grid(col, dtype=np.float64, fill=np.nan):
+        out = np.full((n, 6), fill, dtype=dtype)
+        if col in df.columns:
+            out[rid, ln] = df[col].to_numpy(dtype=dtype, na_value=fill)[keep]
+        return out
+
+    eval_col = "スタート評価" if "スタート評価" in df.columns and df["スタート評価"].notna().any() else "評価"
+    eval_codes = np.full((n, 6), -1, dtype=np.int16)
+    categories = []
+    if eval_col in df.columns:
+        cat = pd.Categorical(df[eval_col].astype(object).where(df[eval_col].notna(), None))
+        categories = list(cat.categories)
+        eval_codes[rid, ln] = np.asarray(cat.codes, dtype=np.int16)[keep]
+
+    first = np.zeros(n, dtype=np.int64)
+    first[rid[ln == 0]] = np.flatnonzero(keep)[ln == 0]
+    # 払戻はレース単位の値なので、6艇のうち入力のある値を使う
+    payouts = {}
+    for bet, col in PAYOUT_COLS.items():
+        if col in df.columns and df[col].notna().any():
+            payouts[bet] = np.fmax.reduce(grid(col), axis=1)
+    return {
+        "日付": df["日付"].to_numpy()[first],
+        "レース番号": df["レース番号"].to_numpy()[first],
+        "展示": grid("展示"),
+        "直線": grid("直線"),
+        "一周": grid("一周"),
+        "回り足": grid("回り足"),
+        "ST": grid("ST"),
+        "着順": grid("着順"),
+        "eval_codes": eval_codes,
+        "eval_categories": categories,
+        "払戻": payouts,
+    }
+
+
+def input_matrix(tenji, isshu, st_, evals):
+    # 当日入力（6艇分）を race_matrix と同じ形の1レース分にする（start_index にそのまま渡せる）
+    categories = sorted({e for e in evals if e})
+    return {
+        "展示": np.asarray(tenji, dtype=float)[None, :],
+        "一周": np.asarray(isshu, dtype=float)[None, :],
+        "ST": np.asarray(st_, dtype=float)[None, :],
+        "eval_codes": np.array([[categories.index(e) if e else -1 for e in evals]], dtype=np.int16),
+        "eval_categories": categories,
+    }
+
+
+def eval_bonus(m, eval_map):
+    # 評価記号 → 補正値（未入力・対象外は 0）
+    table = np.array([eval_map.get(c, 0.0) for c in m["eval_categories"]] + [0.0])
+    return table[m["eval_codes"]]
+
+
+def start_index(m, mean_tenji, mean_isshu, params=None):
+    # 係数はスカラーか (n, 1) の配列（ウォークフォワードでレースごとに選び直した係数）。
+    # eval_scale は評価補正全体の倍率（省略時 1）
+    p = {**DEFAULT_PARAMS, **(params or {})}
+    return (
+        -np.nan_to_num(m["ST"], nan=0.0)
+        + eval_bonus(m, p["eval_map"]) * p.get("eval_scale", 1.0)
+        + (mean_tenji - m["展示"]) * p["w_tenji"]
+        + (mean_isshu - m["一周"]) * p["w_isshu"]
+    )
+
+
+def index_order(score):
+    # 指数の高い順の艇位置（0始まり）。指数が欠損した艇は最後に回す
+    s = np.where(np.isnan(score), -np.inf, score)
+    return np.argsort(-s, axis=1, kind="stable")
+
+
+def hit_arrays(m, score):
+    # 1着が記録されているレースについて、指数上位1/2/3艇に1着艇が含まれるかを返す
+    is_win = m["着順"] == 1
+    has_winner = is_win.any(axis=1)
+    winner = is_win.argmax(axis=1)
+    order = index_order(score)[:, :3]
+    in_top = order == winner[:, None]
+    hits = np.cumsum(in_top, axis=1).astype(bool)
+    return {
+        "valid": has_winner,
+        "order": order,
+        "winner": winner,
+        "1位的中": hits[:, 0],
+        "上位2艇内": hits[:, 1],
+        "上位3艇内": hits[:, 2],
+    }
+
+
+def run_backtest(m, mean_tenji, mean_isshu, params=None, use=None):
+    # tab_mix_check と同じ列構成の検証結果（1レース1行）を返す
+    # mean_tenji / mean_isshu はスカラーか (n, 1) の配列、use は対象レースを絞るマスク
+    h = hit_arrays(m, start_index(m, mean_tenji, mean_isshu, params))
+    v = h["valid"] if use is None else h["valid"] & use
+    order = h["order"][v] + 1
+    return pd.DataFrame({
+        "日付": m["日付"][v],
+        "R": m["レース番号"][v],
+        "指数1位": order[:, 0],
+        "指数2位": order[:, 1],
+        "指数3位": order[:, 2],
+        "1着艇": h["winner"][v] + 1,
+        "1位的中": h["1位的中"][v],
+        "上位2艇内": h["上位2艇内"][v],
+        "上位3艇内": h["上位3艇内"][v],
+    }, columns=RESULT_COLS)
+
+
+def bootstrap_rates(hits, resamples=BOOTSTRAP_RESAMPLES, level=CI_LEVEL, seed=0):
+    # hits は (レース数, 指標数) の bool。レースを復元抽出して求めた的中率（%）の
+    # 下側・上側の分位点を (指標数, 2) で返す。
+    # 的中の組み合わせ（行のパターン）ごとの件数を多項分布で一度に引くので、レースを1件ずつ
+    # 引き直すのと同じ分布が (resamples × パターン数) の配列1つで得られる
+    hits = np.asarray(hits, dtype=bool)
+    if len(hits) == 0:
+        return np.full((hits.shape[1], 2), np.nan)
+    n = len(hits)
+    patterns, counts = np.unique(hits, axis=0, return_counts=True)
+    draws = np.random.default_rng(seed).multinomial(n, counts / n, size=resamples)
+    rates = draws @ patterns.astype(np.float64) / n * 100
+    alpha = (1 - level) / 2
+    return np.quantile(rates, [alpha, 1 - alpha], axis=0).T
+
+
+def index_ranks(score):
+    # 各艇の指数順位（0始まり、(n, 6)）
+    order = index_order(score)
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(6), axis=1)
+    return ranks
+
+
+def combo_hits(m, score):
+    # 券種ごとに、全組番を指数順位の辞書順で並べたときの的中組番の位置と、
+    # 1〜3着艇の指数順位を返す（全レース・全組番を (n, 組番数) の配列で一括計算）
+    ranks = index_ranks(score)
+    place = m["着順"]
+    out = {}
+    for bet, combos in COMBOS.items():
+        k = combos.shape[1]
+        is_pos = [place == j + 1 for j in range(k)]
+        valid = np.all([(p.sum(axis=1) == 1) for p in is_pos], axis=0)
+        finishers = np.stack([p.argmax(axis=1) for p in is_pos], axis=1)
+        fin_ranks = np.take_along_axis(ranks, finishers, axis=1)
+        weights = 6 ** np.arange(k - 1, -1, -1)
+        key = (combos * weights).sum(axis=1)
+        actual = fin_ranks @ weights
+        out[bet] = {
+            "valid": valid,
+            "position": (key[None, :] < actual[:, None]).sum(axis=1),
+            "fin_ranks": fin_ranks,
+        }
+    return out
+
+
+def plan_hits(hits, plan):
+    # 買い目1つについて、(点数, レースごとの的中) を返す
+    bet, _, (kind, spec) = plan
+    h = hits[bet]
+    if kind == "top":
+        return spec, h["position"] < spec
+    combos = COMBOS[bet]
+    points = int(np.all([np.isin(combos[:, j], s) for j, s in enumerate(spec)], axis=0).sum())
+    hit = np.all([np.isin(h["fin_ranks"][:, j], s) for j, s in enumerate(spec)], axis=0)
+    return points, hit
+
+
+def run_combo_backtest(m, mean_tenji, mean_isshu, params=None, plans=BET_PLANS, use=None):
+    # 買い目ごとの的中率と、払戻列がある場合の回収率（100円均等買い）
+    hits = combo_hits(m, start_index(m, mean_tenji, mean_isshu, params))
+    rows = []
+    for plan in plans:
+        bet, name, _ = plan
+        valid = hits[bet]["valid"] if use is None else hits[bet]["valid"] & use
+        points, hit = plan_hits(hits, plan)
+        n = int(valid.sum())
+        roi = avg_pay = np.nan
+        payout = m.get("払戻", {}).get(bet)
+        if payout is not None:
+            paid = valid & ~np.isnan(payout)
+            if paid.any():
+                won = hit[paid]
+                roi = payout[paid][won].sum() / (points * 100 * paid.sum()) * 100
+                avg_pay = payout[paid][won].mean() if won.any() else np.nan
+        rows.append({
+            "券種": bet,
+            "買い目": name,
+            "点数": points,
+            "検証レース数": n,
+            "的中率": hit[valid].mean() * 100 if n else np.nan,
+            "回収率": roi,
+            "平均配当": avg_pay,
+        })
+    return pd.DataFrame(rows, columns=COMBO_RESULT_COLS)
@@ -0,0 +1,187 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from core.fileio import CACHE_DIR, atomic_path
+from core.history import shared_race_matrix
+from core.lane_bias import get_lane_bias
+from core.optimize import walk_forward_params
+from core.store import connect
+from core.backtest import CI_LEVEL, DEFAULT_PARAMS, bootstrap_rates, run_backtest, run_combo_backtest
+
+# ==========================================
+# バックテスト結果のキャッシュ（内容アドレス、メモリ LRU ＋ ディスク）
+# ==========================================
+# キーは「会場・種別・データ版・指数パラメータ（またはウォークフォワードの窓）」のハッシュ。
+# どれかが変われば別キーになるので、無効化の処理は要らない。
+# メモリに最近の MEMORY_ENTRIES 件、ディスクに DISK_ENTRIES 件まで保持し、
+# 再起動後もデータと指数式が同じなら再計算しない。
+BACKTEST_CACHE_DIR = CACHE_DIR / "backtest"
+CACHE_FORMAT = 2
+MEMORY_ENTRIES = 32
+DISK_ENTRIES = 256
+
+_memory = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def index_params(params):
+    # 指数の計算に効くパラメータだけを取り出す（出所・検証値などの付帯情報は除く）
+    p = {**DEFAULT_PARAMS, **(params or {})}
+    return {
+        "w_tenji": float(p["w_tenji"]),
+        "w_isshu": float(p["w_isshu"]),
+        "eval_map": {k: float(v) for k, v in sorted(p["eval_map"].items())},
+    }
+
+
+def cache_key(kind, *parts):
+    blob = json.dumps([CACHE_FORMAT, kind, *parts], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _paths(key):
+    return BACKTEST_CACHE_DIR / f"{key[:32]}.parquet", BACKTEST_CACHE_DIR / f"{key[:32]}.json"
+
+
+def _remember(key, entry):
+    with _lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _load_disk(key):
+    data_path, meta_path = _paths(key)
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("key") != key:
+            return None
+        frame = pd.read_parquet(data_path)
+    except (OSError, ValueError):
+        return None
+    # 参照のたびに mtime を更新し、ディスク側も古い順に消せるようにする
+    os.utime(meta_path)
+    return {"summary": meta["summary"], "results": frame}
+
+
+def _save_disk(key, entry):
+    data_path, meta_path = _paths(key)
+    # 本体を置き換えてからメタデータを置き換える（読む側はメタデータがあれば本体もあるとみなす）
+    with atomic_path(meta_path) as tmp_meta, atomic_path(data_path) as tmp_data:
+        entry["results"].to_parquet(tmp_data, index=False)
+        tmp_meta.write_text(json.dumps({"key": key, "summary": entry["summary"]}, ensure_ascii=False), encoding="utf-8")
+    _prune_disk()
+
+
+def _prune_disk():
+    metas = sorted(BACKTEST_CACHE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for meta_path in metas[:-DISK_ENTRIES]:
+        for p in (meta_path, meta_path.with_suffix(".parquet")):
+            p.unlink(missing_ok=True)
+
+
+def get_or_compute(key, compute):
+    # compute() は {"summary": dict, "results": DataFrame} を返す
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+            return entry
+    entry = _load_disk(key)
+    if entry is None:
+        entry = compute()
+        try:
+            _save_disk(key, entry)
+        except OSError:
+            pass
+    _remember(key, entry)
+    return entry
+
+
+HIT_COLS = {"hit1": "1位的中", "hit2": "上位2艇内", "hit3": "上位3艇内"}
+
+
+def backtest_summary(res_df):
+    # 的中率（%）と、レース単位のブートストラップによる信頼区間 ci = {指標: [下限, 上限]}
+    if res_df.empty:
+        return {"races": 0}
+    hits = res_df[list(HIT_COLS.values())].to_numpy(dtype=bool)
+    ci = bootstrap_rates(hits)
+    return {
+        "races": len(res_df),
+        **{k: float(hits[:, i].mean() * 100) for i, k in enumerate(HIT_COLS)},
+        "ci_level": CI_LEVEL,
+        "ci": {k: [float(lo), float(hi)] for k, (lo, hi) in zip(HIT_COLS, ci)},
+    }
+
+
+def _backtest_key(kind, place, race_type, version, params, window_days):
+    # 会場平均は6艇に同じ量を足すだけで順位・的中に効かないのでキーに含めない
+    # （直近重視の半減期を変えても同じ結果を計算し直さない）。
+    # ウォークフォワードでは係数を窓ごとに選び直すので、係数の代わりに窓の日数をキーにする
+    if window_days:
+        return cache_key(kind, place, race_type, version, ("walk_forward", int(window_days)))
+    return cache_key(kind, place, race_type, version, params)
+
+
+def _index_setup(m, mean_tenji, mean_isshu, params, window_days):
+    # (平均展示, 平均一周, 係数, 対象レースのマスク)。window_days 指定時は各日の直前の窓で係数を選び直す
+    if window_days:
+        wf_params, use = walk_forward_params(m, window_days)
+        return 0.0, 0.0, wf_params, use
+    return mean_tenji, mean_isshu, params, None
+
+
+def cached_backtest(place, race_type, version, mean_tenji, mean_isshu, params, load_matrix, window_days=None):
+    # load_matrix はキャッシュに無いときだけ呼ぶ（配列の組み立ても省ける）
+    p = index_params(params)
+    key = _backtest_key("start_index", place, race_type, version, p, window_days)
+
+    def compute():
+        m = load_matrix()
+        mt, mi, run_p, use = _index_setup(m, mean_tenji, mean_isshu, p, window_days)
+        res_df = run_backtest(m, mt, mi, run_p, use=use)
+        return {"summary": backtest_summary(res_df), "results": res_df}
+
+    return get_or_compute(key, compute)
+
+
+def cached_combo_backtest(place, race_type, version, mean_tenji, mean_isshu, params, load_matrix, window_days=None):
+    # 2連単・3連単の買い目別 的中率・回収率（結果は買い目ごとに1行）
+    p = index_params(params)
+    key = _backtest_key("combo", place, race_type, version, p, window_days)
+
+    def compute():
+        m = load_matrix()
+        mt, mi, run_p, use = _index_setup(m, mean_tenji, mean_isshu, p, window_days)
+        return {"summary": {}, "results": run_combo_backtest(m, mt, mi, run_p, use=use)}
+
+    return get_or_compute(key, compute)
+
+
+def venue_backtests(race_type="混合"):
+    # ホームの的中実績: 会場DBにある各会場を全期間平均・既定係数で検証する。
+    # core.optimize の係数は同じ履歴で選んだものなので、使うと学習データ内の（高めの）的中率になる
+    with connect() as con:
+        sources = con.execute(
+            "SELECT 会場, version FROM sources WHERE 種別 = ? ORDER BY 会場", (race_type,)
+        ).fetchall()
+    out = {}
+    for place, version in sources:
+        lane = get_lane_bias(place, race_type, version)
+        if lane is None:
+            continue
+        overall_mean = lane["overall_mean"]
+        bt = cached_backtest(
+            place, race_type, version, overall_mean["展示"], overall_mean["一周"],
+            DEFAULT_PARAMS,
+            lambda place=place, version=version: shared_race_matrix(place, race_type, version),
+        )
+        out[place] = bt["summary"]
+    return out
@@ -0,0 +1,216 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.backtest import race_matrix
+from core.fileio import stats_cli
+from core.pre_eval import MARK_METRICS, MIN_MONTH_ROWS, RACE_POINTS, RECENT_DAYS, WEIGHTS, mark_points
+from core.store import connect, race_rows
+
+# ==========================================
+# 予想％ の較正（信頼度曲線・Brier・対数損失）と補正マッピング
+# ==========================================
+# 例: python -m core.calibration            （全シートを同期してから集計）
+#     python -m core.calibration --no-sync  （会場DBにある分だけで集計）
+# 事前簡易予想の自動入力（枠番別の直近成績 → 記号 → スコア比％）を過去の各レースで再現し、
+# 予想％の区間ごとの実際の1着率と比べる。レースは (n, 6) の行列のまま一括で処理する。
+# 記号の五分位点も、各レースの月より前に終わった月だけから作る（そのレースの結果を含めない）。
+# 補正マッピングは区間ごとの実績を単調（isotonic）にならしたもので、表示時は線形補間して
+# 合計100％に正規化し直す。会場ページはデータ版ごとに計算し、CLI は全会場の較正結果を表示する。
+
+# 予想％の区間（確率）。6艇のスコア比なので 10〜30% 付近を細かく切る
+BIN_EDGES = [0.0, 0.05, 0.10, 0.15, 0.20, 0.25, 0.30, 0.40, 0.50, 1.0]
+# 補正の検証用に、日付順で後ろのこの割合のレースを当てはめに使わず評価する
+HOLDOUT_FRACTION = 0.3
+# これ未満のレース数では補正マッピングを作らない
+MIN_CALIBRATION_RACES = 300
+EPS = 1e-6
+
+logger = logging.getLogger(__name__)
+
+
+def _trailing_lane_means(day, values, window_days):
+    # 各レースの「その日より前の window_days 日間」の艇番別平均と件数（(n, 6) ずつ）。
+    # core.optimize.walk_forward_params と同じく、日ごとの合計の累積和の差で求める
+    days, day_idx = np.unique(day, return_inverse=True)
+    left = np.searchsorted(days, days - np.timedelta64(int(window_days), "D"), side="left")
+    right = np.arange(len(days))
+
+    def window(weights):
+        daily = np.zeros((len(days), 6))
+        np.add.at(daily, day_idx, weights)
+        total = np.concatenate([np.zeros((1, 6)), np.cumsum(daily, axis=0)])
+        return (total[right] - total[left])[day_idx]
+
+    sums = window(np.nan_to_num(values))
+    counts = window((~np.isnan(values)).astype(float))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts, counts
+
+
+def _trailing_cuts(day, values):
+    # 各レースの月より前の「艇番 × 月」の平均（MIN_MONTH_ROWS 件以上の月）の五分位点 (n, 4)。
+    # core.pre_eval.lane_marks と同じ分布を、そのレースの時点で分かっていた月だけで作る（無ければ NaN）
+    months, month_idx = np.unique(day.astype("datetime64[M]"), return_inverse=True)
+    k = len(months)
+    sums = np.zeros((k, 6))
+    counts = np.zeros((k, 6))
+    np.add.at(sums, month_idx, np.nan_to_num(values))
+    np.add.at(counts, month_idx, (~np.isnan(values)).astype(float))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    means[np.bincount(month_idx, minlength=k) < MIN_MONTH_ROWS] = np.nan
+
+    cuts = np.full((k, 4), np.nan)
+    for i in range(1, k):
+        prior = means[:i].ravel()
+        prior = prior[~np.isnan(prior)]
+        if prior.size:
+            cuts[i] = np.quantile(prior, [0.2, 0.4, 0.6, 0.8])
+    return cuts[month_idx]
+
+
+def replay_pre_eval(m, window_days=RECENT_DAYS):
+    # 過去の各レースで、自動入力と同じ記号を直前 window_days 日の枠番別成績と前月までの分布から付け、
+    # 予想％（確率）を求める。モーターは履歴に無いので「無」。
+    # 戻り値: (予想 (n, 6), 1着 (n, 6) bool, 使えるレースのマスク (n,))
+    day = pd.to_datetime(pd.Series(m["日付"]), errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+    finish = m["着順"]
+    points = np.full(8, np.nan)
+    points[list(RACE_POINTS)] = list(RACE_POINTS.values())
+    metrics = {
+        "勝率点": points[np.clip(np.nan_to_num(finish), 0, 7).astype(int)],
+        "1着率": np.where(np.isnan(finish), np.nan, (finish == 1).astype(float)),
+        "平均ST": m["ST"],
+    }
+    dated = ~np.isnat(day)
+    n = len(day)
+    score = np.zeros((n, 6))
+    enough = dated.copy()
+    weight_of = {"当地勝率": WEIGHTS["当地勝率"], "枠番勝率": WEIGHTS["枠番勝率"], "枠番ST": WEIGHTS["枠番スタート"]}
+    if dated.any():
+        for item, (metric, higher) in MARK_METRICS.items():
+            means, counts = _trailing_lane_means(day[dated], metrics[metric][dated], window_days)
+            cuts = _trailing_cuts(day[dated], metrics[metric][dated])
+            score[dated] += weight_of[item] * mark_points(means, cuts, higher)
+            enough[dated] &= (counts >= MIN_MONTH_ROWS).all(axis=1) & ~np.isnan(cuts).any(axis=1)
+
+    total = score.sum(axis=1)
+    won = finish == 1
+    use = enough & (total > 0) & (won.sum(axis=1) == 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pred = score / total[:, None]
+    return pred, won, use
+
+
+def reliability(pred, won, edges=BIN_EDGES):
+    # 信頼度曲線（区間ごとの件数・平均予想・実際の1着率）と Brier・対数損失。pred, won は (n, 6)
+    p, y = pred.ravel(), won.ravel().astype(float)
+    b = np.clip(np.searchsorted(edges, p, side="right") - 1, 0, len(edges) - 2)
+    k = len(edges) - 1
+    n = np.bincount(b, minlength=k)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_pred = np.bincount(b, weights=p, minlength=k) / n
+        observed = np.bincount(b, weights=y, minlength=k) / n
+    table = pd.DataFrame({
+        "区間": [f"{edges[i] * 100:.0f}〜{edges[i + 1] * 100:.0f}%" for i in range(k)],
+        "件数": n,
+        "平均予想": mean_pred * 100,
+        "実際の1着率": observed * 100,
+    })
+    return table, scores(pred, won)
+
+
+def scores(pred, won):
+    # Brier は艇ごと（1着か否か）の二乗誤差の平均、対数損失は1着艇の予想確率の −log の平均
+    if len(pred) == 0:
+        return {"races": 0, "brier": None, "logloss": None}
+    brier = float(np.mean((pred - won) ** 2))
+    logloss = float(-np.mean(np.log(np.clip(pred[won], EPS, 1.0))))
+    return {"races": int(len(pred)), "brier": brier, "logloss": logloss}
+
+
+def _isotonic(x, y, w):
+    # 重み付きの隣接違反プール（PAV）。x 昇順の y を単調非減少にならす
+    blocks = []  # [重み付き平均, 重み, 区間数]
+    for yi, wi in zip(y, w):
+        blocks.append([yi, wi, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            y2, w2, c2 = blocks.pop()
+            y1, w1, c1 = blocks.pop()
+            blocks.append([(y1 * w1 + y2 * w2) / (w1 + w2), w1 + w2, c1 + c2])
+    return np.repeat([v for v, _, _ in blocks], [c for _, _, c in blocks])
+
+
+def fit_mapping(pred, won, edges=BIN_EDGES):
+    # 区間の平均予想 → 実際の1着率 を単調にならした折れ線（{"x": [...], "y": [...]}、確率）
+    table, _ = reliability(pred, won, edges)
+    table = table[table["件数"] > 0]
+    if table.empty:
+        return None
+    x = table["平均予想"].to_numpy() / 100
+    y = _isotonic(x, table["実際の1着率"].to_numpy() / 100, table["件数"].to_numpy(dtype=float))
+    return {"x": x.round(6).tolist(), "y": y.round(6).tolist()}
+
+
+def recalibrate(pct, mapping):
+    # 予想％（合計100、(6,) または (n, 6)）を補正マッピングで写し、合計100に正規化し直す
+    pct = np.asarray(pct, dtype=float)
+    if not mapping:
+        return pct
+    p = np.interp(pct / 100, mapping["x"], mapping["y"])
+    p = np.where(pct > 0, np.maximum(p, EPS), 0.0)
+    total = p.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, p / total * 100, pct)
+
+
+def build_calibration(place, race_type):
+    m = race_matrix(race_rows(place, race_type))
+    pred, won, use = replay_pre_eval(m)
+    pred, won = pred[use], won[use]
+    table, overall = reliability(pred, won)
+    entry = {"table": table, "scores": overall, "mapping": None, "holdout": None}
+    if len(pred) < MIN_CALIBRATION_RACES:
+        return entry
+
+    # 前半で当てはめた補正を後半で評価する（レースは日付順）
+    split = int(len(pred) * (1 - HOLDOUT_FRACTION))
+    train_map = fit_mapping(pred[:split], won[:split])
+    test_pred, test_won = pred[split:], won[split:]
+    entry["holdout"] = {
+        "補正前": scores(test_pred, test_won),
+        "補正後": scores(recalibrate(test_pred * 100, train_map) / 100, test_won),
+    }
+    entry["mapping"] = fit_mapping(pred, won)
+    return entry
+
+
+@st.cache_resource(max_entries=64)
+def shared_calibration(place, race_type, version):
+    return build_calibration(place, race_type)
+
+
+def build_all_calibrations():
+    # {会場: {種別: build_calibration の結果}}
+    venues = {}
+    with connect() as con:
+        sources = con.execute("SELECT 会場, 種別 FROM sources ORDER BY 会場, 種別").fetchall()
+    for place, race_type in sources:
+        venues.setdefault(place, {})[race_type] = build_calibration(place, race_type)
+    return venues
+
+
+if __name__ == "__main__":
+    stats_cli("予想％の較正（信頼度曲線・Brier・対数損失）と補正の検証結果を表示する")
+    for place, types in build_all_calibrations().items():
+        for race_type, entry in types.items():
+            s, h = entry["scores"], entry["holdout"]
+            line = f"{place} {race_type}: {s['races']} races"
+            if s["races"]:
+                line += f", Brier {s['brier']:.4f}, log-loss {s['logloss']:.4f}"
+            if h:
+                line += f" | holdout log-loss {h['補正前']['logloss']:.4f} -> {h['補正後']['logloss']:.4f}"
+            print(line)
@@ -0,0 +1,200 @@
+import datetime
+import json
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.fileio import STATS_DIR, atomic_path, stats_cli
+from core.store import ITEMS, connect, row_key
+
+# ==========================================
+# STEP4 条件補正: 風向・風速・波高の区分ごとの艇番別平均（オフライン CLI で作成）
+# ==========================================
+# 例: python -m core.conditions            （全シートを同期してから集計）
+#     python -m core.conditions --no-sync  （会場DBにある分だけで集計）
+# 会場 × 種別 × 風向 × 風速 × 波高 × 艇番 × 項目 の合計と件数を配列で保存し、
+# 会場ページは当日の条件から添字を求めて1セルを参照するだけにする（履歴の走査なし）。
+# シートは追記のみなので、集計時の行数と最終行が今の会場DBと一致すれば（追記があっても）そのまま使う。
+CUBE_PATH = STATS_DIR / "condition_cube.npz"
+CUBE_FORMAT = 2
+
+WIND_DIRS = ["無風", "北", "北東", "東", "南東", "南", "南西", "西", "北西"]
+# 16方位の表記は近い8方位にまとめる
+_DIR16 = ["北", "北北東", "北東", "東北東", "東", "東南東", "南東", "南南東",
+          "南", "南南西", "南西", "西南西", "西", "西北西", "北西", "北北西"]
+WIND_SPEED_EDGES = [2, 4, 6]   # m/s:  0-1 / 2-3 / 4-5 / 6以上
+WAVE_EDGES = [3, 6, 10]        # cm:   0-2 / 3-5 / 6-9 / 10以上
+WIND_SPEED_LABELS = ["0〜1m", "2〜3m", "4〜5m", "6m以上"]
+WAVE_LABELS = ["0〜2cm", "3〜5cm", "6〜9cm", "10cm以上"]
+
+# この件数未満のセルは補正に使わない（サンプル不足）
+MIN_CELL_ROWS = 30
+
+SHAPE = (len(WIND_DIRS), len(WIND_SPEED_EDGES) + 1, len(WAVE_EDGES) + 1, 6, len(ITEMS))
+
+logger = logging.getLogger(__name__)
+
+
+def wind_dir_index(direction, speed=None):
+    # 風向の表記 → WIND_DIRS の添字（風速0や読めない表記は「無風」）
+    if speed is not None and not pd.isna(speed) and speed < 1:
+        return 0
+    d = str(direction or "").strip().replace("風", "")
+    if d in _DIR16:
+        return 1 + (_DIR16.index(d) + 1) // 2 % 8
+    return 0
+
+
+def speed_index(speed):
+    return int(np.searchsorted(WIND_SPEED_EDGES, 0 if pd.isna(speed) else speed, side="right"))
+
+
+def wave_index(wave):
+    return int(np.searchsorted(WAVE_EDGES, 0 if pd.isna(wave) else wave, side="right"))
+
+
+def _source_cube(con, place, race_type):
+    df = pd.read_sql_query(
+        f"SELECT 艇番, 風向, 風速, 波高, {', '.join(ITEMS)} FROM races "
+        "WHERE 会場 = ? AND 種別 = ? AND 艇番 BETWEEN 1 AND 6 AND 風速 IS NOT NULL",
+        con, params=(place, race_type),
+    )
+    sums = np.zeros(SHAPE)
+    counts = np.zeros(SHAPE, dtype=np.int32)
+    if df.empty:
+        return sums, counts
+    speed = df["風速"].to_numpy(dtype=float)
+    d = np.array([wind_dir_index(x) for x in df["風向"]])
+    d[np.nan_to_num(speed, nan=0.0) < 1] = 0
+    s = np.searchsorted(WIND_SPEED_EDGES, np.nan_to_num(speed, nan=0.0), side="right")
+    w = np.searchsorted(WAVE_EDGES, np.nan_to_num(df["波高"].to_numpy(dtype=float), nan=0.0), side="right")
+    lane = df["艇番"].to_numpy(dtype=np.int64) - 1
+    values = df[ITEMS].to_numpy(dtype=float)
+    ok = ~np.isnan(values)
+    np.add.at(sums, (d, s, w, lane), np.where(ok, values, 0.0))
+    np.add.at(counts, (d, s, w, lane), ok)
+    return sums, counts
+
+
+def build_condition_cube():
+    keys, versions, rows, last_keys, all_sums, all_counts = [], [], [], [], [], []
+    with connect() as con:
+        sources = con.execute("SELECT 会場, 種別, version, rows FROM sources ORDER BY 会場, 種別").fetchall()
+        for place, race_type, version, n_rows in sources:
+            sums, counts = _source_cube(con, place, race_type)
+            if not counts.any():
+                continue
+            keys.append(f"{place}|{race_type}")
+            versions.append(version)
+            rows.append(n_rows)
+            last_keys.append(_key_text(row_key(place, race_type, n_rows - 1)))
+            all_sums.append(sums)
+            all_counts.append(counts)
+    meta = {
+        "format": CUBE_FORMAT,
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "wind_dirs": WIND_DIRS,
+        "wind_speed_edges": WIND_SPEED_EDGES,
+        "wave_edges": WAVE_EDGES,
+        "items": ITEMS,
+    }
+    return {
+        "meta": meta,
+        "keys": keys,
+        "versions": versions,
+        "rows": rows,
+        "last_keys": last_keys,
+        "sums": np.stack(all_sums) if all_sums else np.zeros((0, *SHAPE)),
+        "counts": np.stack(all_counts) if all_counts else np.zeros((0, *SHAPE), dtype=np.int32),
+    }
+
+
+def write_condition_cube(cube, path=None):
+    # ファイルオブジェクトに書けば np.savez は一時ファイル名に .npz を足さない
+    with atomic_path(path or CUBE_PATH) as tmp, open(tmp, "wb") as f:
+        np.savez_compressed(
+            f,
+            meta=np.array(json.dumps(cube["meta"], ensure_ascii=False)),
+            keys=np.array(cube["keys"]),
+            versions=np.array(cube["versions"]),
+            rows=np.array(cube["rows"], dtype=np.int64),
+            last_keys=np.array(cube["last_keys"]),
+            sums=cube["sums"],
+            counts=cube["counts"],
+        )
+
+
+@st.cache_resource
+def _load_condition_cube(path, mtime):
+    # ファイルが更新されたら（mtime が変われば）読み直す
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        if meta.get("format") != CUBE_FORMAT:
+            return None
+        counts = z["counts"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = z["sums"] / counts
+            # 条件を問わない艇番別平均（補正量の基準）
+            base = z["sums"].sum(axis=(1, 2, 3)) / counts.sum(axis=(1, 2, 3))
+        return {
+            "meta": meta,
+            "index": {k: i for i, k in enumerate(z["keys"].tolist())},
+            "versions": z["versions"].tolist(),
+            "rows": z["rows"].tolist(),
+            "last_keys": z["last_keys"].tolist(),
+            "means": means,
+            "counts": counts,
+            "base": base,
+        }
+
+
+def load_condition_cube(path=None):
+    path = pathlib.Path(path or CUBE_PATH)
+    if not path.exists():
+        return None
+    return _load_condition_cube(str(path), path.stat().st_mtime)
+
+
+def _key_text(key):
+    return "|".join(map(str, key)) if key else ""
+
+
+def _cube_matches(cube, i, place, race_type, version):
+    # 集計時と同じデータ版か、集計時の行までが今の会場DBの先頭と同じ（その後は追記だけ）なら使える
+    if cube["versions"][i] == version:
+        return True
+    n_rows = cube["rows"][i]
+    return n_rows > 0 and _key_text(row_key(place, race_type, n_rows - 1)) == cube["last_keys"][i]
+
+
+def condition_offsets(place, race_type, version, direction, speed, wave):
+    # 当日の条件での艇番別平均 − 条件を問わない艇番別平均（艇番 × 項目の DataFrame）と件数。
+    # 集計が無い・読込中のデータ（version）が集計時のデータの追記でない場合は None、
+    # 件数が MIN_CELL_ROWS 未満の艇・項目は NaN
+    cube = load_condition_cube()
+    i = (cube or {}).get("index", {}).get(f"{place}|{race_type}")
+    if i is None or version is None or not _cube_matches(cube, i, place, race_type, version):
+        return None
+    cell = (i, wind_dir_index(direction, speed), speed_index(speed), wave_index(wave))
+    n = cube["counts"][cell]
+    offset = np.where(n >= MIN_CELL_ROWS, cube["means"][cell] - cube["base"][i], np.nan)
+    lanes = pd.Index(range(1, 7), name="艇番")
+    return pd.DataFrame(offset, index=lanes, columns=ITEMS), pd.DataFrame(n, index=lanes, columns=ITEMS)
+
+
+def apply_condition_offsets(df, offset):
+    # 補正済みタイムから当日条件による遅れ・速さを差し引く（補正量が無い艇・項目はそのまま）
+    out = df.copy()
+    out[ITEMS] = df[ITEMS].to_numpy() - np.nan_to_num(offset.reindex(df.index)[ITEMS].to_numpy())
+    return out
+
+
+if __name__ == "__main__":
+    args = stats_cli("風・波の条件別 艇番平均（条件補正キューブ）を作成する", out=CUBE_PATH)
+    cube = build_condition_cube()
+    write_condition_cube(cube, args.out)
+    print(f"{args.out}: {len(cube['keys'])} sheets, {os.path.getsize(args.out) / 1024:.1f} KB")
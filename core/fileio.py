@@ -0,0 +1,52 @@
+import argparse
+import contextlib
+import logging
+import os
+import pathlib
+import threading
+
+# ==========================================
+# 保存先とファイル書き込み・集計 CLI の共通部分
+# ==========================================
+BASE_DIR = pathlib.Path(__file__).parent.parent.resolve()
+CACHE_DIR = BASE_DIR / ".cache"   # 取得・計算結果のキャッシュ（消しても作り直せる）
+STATS_DIR = BASE_DIR / "stats"    # 集計 CLI の出力
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    # 書き込み途中のファイルを読まれないよう、一時ファイルに書かせてから置き換える。
+    # 一時ファイル名にプロセス・スレッドを含め、同じファイルを同時に書いても互いを壊さない
+    # （末尾は .tmp なので、*.json などで保存先を探す側に書き込み途中のファイルは見えない）
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write_atomic(path, data):
+    # data は bytes か str（str は UTF-8 で書く）
+    with atomic_path(path) as tmp:
+        if isinstance(data, bytes):
+            tmp.write_bytes(data)
+        else:
+            tmp.write_text(data, encoding="utf-8")
+
+
+def stats_cli(description, out=None):
+    # 集計 CLI 共通の --no-sync（と --out）を解釈し、指定が無ければ全シートを同期してから引数を返す
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--no-sync", action="store_true", help="シートを同期せず会場DBの内容だけで集計する")
+    if out is not None:
+        parser.add_argument("--out", default=str(out))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.no_sync:
+        from core.prefetch import prefetch_all
+        prefetch_all()
+    return args
@@ -0,0 +1,229 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.fileio import CACHE_DIR, write_atomic
+
+# ==========================================
+# GAS 統計エンドポイントの取得（条件付き・圧縮・ディスク永続化）
+# ==========================================
+GAS_CACHE_DIR = CACHE_DIR / "gas"
+GAS_TIMEOUT = 60
+# 集計ロジックを変えたら上げる（ディスクに残った古い集計結果を使わないため）
+STATS_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_gas_url(url):
+    # BOAT_FAKE_GOOGLE が指定されていればローカル代替サーバーの /gas を使う
+    fake = os.environ.get("BOAT_FAKE_GOOGLE", "").rstrip("/")
+    return f"{fake}/gas" if fake else url
+
+
+@st.cache_resource
+def get_http_session():
+    # 接続を使い回すセッション（gzip 受け入れ・一時エラーは自動再試行）
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+def _cache_paths(url):
+    stem = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return GAS_CACHE_DIR / f"{stem}.json.gz", GAS_CACHE_DIR / f"{stem}.meta.json"
+
+
+def _read_meta(meta_path):
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def _read_body(url):
+    return gzip.decompress(_cache_paths(url)[0].read_bytes())
+
+
+def fetch_gas_raw(url):
+    # 前回の ETag / Last-Modified で再検証する。
+    # 戻り値: (本文 bytes / 未変更でディスクの写しを使う場合は None, 内容ハッシュ, 計測情報)
+    GAS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    body_path, meta_path = _cache_paths(url)
+    meta = _read_meta(meta_path) if body_path.exists() else {}
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    timing = {"status": None, "bytes": 0}
+    t0 = time.perf_counter()
+    try:
+        resp = get_http_session().get(url, headers=headers, timeout=GAS_TIMEOUT)
+        timing["status"] = resp.status_code
+        if resp.status_code != 304:
+            resp.raise_for_status()
+    except requests.RequestException:
+        if not meta:
+            raise
+        # 通信できない場合は最後に取得できた写しで継続する
+        logger.warning("GAS fetch failed; serving disk copy", exc_info=True)
+        resp = None
+    timing["request_s"] = round(time.perf_counter() - t0, 3)
+
+    if resp is None or resp.status_code == 304:
+        logger.info("GAS fetch: %s", timing)
+        return None, meta["sha256"], timing
+
+    raw = resp.content
+    timing["bytes"] = len(raw)
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest != meta.get("sha256"):
+        write_atomic(body_path, gzip.compress(raw))
+    meta = {
+        "sha256": digest,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
+    write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    logger.info("GAS fetch: %s", timing)
+    return raw, digest, timing
+
+
+def fetch_gas_json(url):
+    raw, digest, timing = fetch_gas_raw(url)
+    t0 = time.perf_counter()
+    data = json.loads(raw if raw is not None else _read_body(url))
+    timing["parse_s"] = round(time.perf_counter() - t0, 3)
+    return data, digest, timing
+
+
+def build_place_stats(all_data):
+    stats = {}
+    for sheet_name, rows in all_data.items():
+        if len(rows) < 2: continue
+
+        # 会場名の整形 (例: 桐生_混合統計 -> 桐生)
+        place = sheet_name.replace("_混合統計", "").strip()
+
+        # DataFrame化 (1行目はヘッダー)
+        df = pd.DataFrame(rows[1:], columns=rows[0])
+
+        # 列名の空白削除
+        df.columns = df.columns.str.strip()
+
+        # 数値変換 (エラーはNaNにして除外)
+        df['着順_num'] = pd.to_numeric(df['着順'], errors='coerce')
+        df['展示_num'] = pd.to_numeric(df['展示'], errors='coerce')
+        df = df.dropna(subset=['着順_num', '展示_num'])
+
+        if df.empty: continue
+
+        # 展示順位の計算 (レースごとにグループ化)
+        # ※日付、レース番号、会場名が一致するものを1レースとする
+        df['展示順位'] = df.groupby(['日付', 'レース番号'])['展示_num'].rank(method='min')
+
+        # 統計指標の算出
+        top_ex = df[df['展示順位'] == 1]
+        win_rate = (top_ex['着順_num'] == 1).mean() * 100 if not top_ex.empty else 35.0
+        show_rate = (top_ex['着順_num'] <= 3).mean() * 100 if not top_ex.empty else 65.0
+        in_nige = (df[df['艇番'] == 1]['着順_num'] == 1).mean() * 100 if not df[df['艇番'] == 1].empty else 50.0
+
+        stats[place] = {
+            "展示信頼度": round(win_rate, 1), # 展示1位が1着をとる確率
+            "展示貢献度": round(show_rate, 1), # 展示1位が3着以内に入る確率
+            "イン逃げ率": round(in_nige, 1),
+            "サンプル数": len(df)
+        }
+    return stats
+
+
+def load_place_stats(url):
+    # 内容ハッシュが前回と同じなら集計結果もディスクから返す（再集計しない）
+    raw, digest, timing = fetch_gas_raw(url)
+    stats_path = GAS_CACHE_DIR / f"stats_v{STATS_FORMAT}_{digest[:16]}.json"
+    if stats_path.exists():
+        return json.loads(stats_path.read_text(encoding="utf-8")), timing
+
+    t0 = time.perf_counter()
+    stats = build_place_stats(json.loads(raw if raw is not None else _read_body(url)))
+    timing["build_s"] = round(time.perf_counter() - t0, 3)
+    for old in GAS_CACHE_DIR.glob("stats_*.json"):
+        old.unlink(missing_ok=True)
+    write_atomic(stats_path, json.dumps(stats, ensure_ascii=False).encode("utf-8"))
+    return stats, timing
+
+
+def load_last_place_stats(url):
+    # 通信せず、ディスクに残っている最後の集計結果を返す（無ければ None）
+    meta = _read_meta(_cache_paths(url)[1])
+    if not meta.get("sha256"):
+        return None
+    stats_path = GAS_CACHE_DIR / f"stats_v{STATS_FORMAT}_{meta['sha256'][:16]}.json"
+    if not stats_path.exists():
+        return None
+    return json.loads(stats_path.read_text(encoding="utf-8")), stats_path.stat().st_mtime
+
+
+class StaleWhileRevalidate:
+    # 最後に取得できた集計結果を即座に返し、期限切れならバックグラウンドで取り直す。
+    # 新しい結果は {"stats", "as_of"} の辞書ごと差し替えるので読み手はロック不要。
+    def __init__(self, url, ttl=3600):
+        self.url = url
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._current = None
+        last = load_last_place_stats(url)
+        if last is not None:
+            stats, mtime = last
+            # 起動直後はディスクの写しで表示し、すぐに再検証する
+            self._current = {"stats": stats, "as_of": mtime, "checked_at": 0.0}
+
+    def _refresh(self):
+        try:
+            stats, _timing = load_place_stats(self.url)
+            now = time.time()
+            self._current = {"stats": stats, "as_of": now, "checked_at": now}
+        except Exception:
+            logger.exception("GAS stats refresh failed; keeping last good value")
+            if self._current is not None:
+                self._current = {**self._current, "checked_at": time.time()}
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True, name="gas-refresh").start()
+
+    def get(self):
+        current = self._current
+        if current is None:
+            # 手元に何も無い初回だけは取得を待つ（失敗時は例外）
+            stats, _timing = load_place_stats(self.url)
+            now = time.time()
+            self._current = current = {"stats": stats, "as_of": now, "checked_at": now}
+        elif time.time() - current["checked_at"] > self.ttl:
+            self._refresh_in_background()
+        return current
@@ -0,0 +1,26 @@
+import streamlit as st
+
+from core.backtest import race_matrix
+from core.store import race_rows
+
+# ==========================================
+# プロセス共有のレース履歴キャッシュ
+# ==========================================
+# 検証用の行・配列は (会場, 種別, データ版) ごとにプロセス内で1つだけ保持し、
+# 各セッションは history_ref() の軽い参照だけを session_state に持つ。
+
+
+@st.cache_resource(max_entries=64)
+def shared_race_rows(place, race_type, version):
+    # 検証タブ用の完走レース行（会場DBから取得）もデータ版ごとに共有する
+    return race_rows(place, race_type)
+
+
+@st.cache_resource(max_entries=64)
+def shared_race_matrix(place, race_type, version):
+    # バックテスト用の (レース数 × 6艇) 配列。並べ替えはデータ版ごとに1回だけ
+    return race_matrix(shared_race_rows(place, race_type, version))
+
+
+def history_ref(sheet_key, title, meta):
+    return {"sheet_key": sheet_key, "title": title, "version": meta["version"], "rows": meta["rows"]}
@@ -0,0 +1,132 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.store import ITEMS, lane_rows, lane_stats, row_key
+from core.venue_stats import load_venue_stats, snapshot_lane_stats
+
+# ==========================================
+# 艇番別の平均・枠番補正量（統計解析・スタート予想・項目別順位で共有）
+# ==========================================
+# Streamlit は毎回すべてのタブを実行するので、集計はデータ版ごとにプロセスで1回だけ行い、
+# 各タブは同じ結果を参照する。補正は艇番でそろえた配列の引き算1回で行う。
+LANES = range(1, 7)
+DEFAULT_HALF_LIFE_DAYS = 180
+
+
+def _bias_entry(place_mean, overall_mean, n_rows):
+    return {
+        "place_mean": place_mean,
+        "overall_mean": overall_mean,
+        "lane_bias": place_mean[ITEMS] - overall_mean[ITEMS],
+        "rows": n_rows,
+    }
+
+
+@st.cache_resource(max_entries=64)
+def shared_lane_bias(place, race_type, source, version):
+    # source は "store"（会場DB）か "snapshot"（事前集計）。version はそのデータ版
+    stats = lane_stats(place, race_type) if source == "store" else snapshot_lane_stats(place, race_type)
+    if stats is None:
+        return None
+    return _bias_entry(*stats)
+
+
+def get_lane_bias(place, race_type, version=None):
+    # 読込済み（version あり）なら会場DB、未読込なら事前集計スナップショットの艇番別統計
+    if version is not None:
+        return shared_lane_bias(place, race_type, "store", version)
+    entry = (load_venue_stats() or {}).get("venues", {}).get(place, {}).get(race_type)
+    if not entry:
+        return None
+    return shared_lane_bias(place, race_type, "snapshot", entry["version"])
+
+
+# ==========================================
+# 時間減衰つきの艇番別平均（直近のレースほど重く）
+# ==========================================
+# 艇番 × 項目ごとに「重み付き合計」と「重みの合計」だけを持つ。新しい日のデータが来たら
+# 既存の合計に 0.5^(経過日数 / 半減期) を掛けてから足すので、1レースの追加は定数時間。
+# 平均は合計どうしの比なので、どの日を基準にしても同じ値になる。
+class DecayedLaneSums:
+    def __init__(self, half_life_days):
+        self.half_life = float(half_life_days)
+        self.wsum = np.zeros((6, len(ITEMS)))
+        self.weight = np.zeros((6, len(ITEMS)))
+        self.day = None  # 合計の基準日（これまでに加えた最新の日）
+        self.rows = 0
+        self.last_key = None
+
+    def _decay(self, days):
+        return 0.5 ** ((self.day - days) / np.timedelta64(1, "D") / self.half_life)
+
+    def add_rows(self, days, lanes, values):
+        # days: datetime64[D] (k,), lanes: 艇番 (k,), values: (k, 項目数)。日付の無い行は重み1（基準日扱い）
+        dated = ~np.isnat(days)
+        if dated.any():
+            latest = days[dated].max()
+            if self.day is None:
+                self.day = latest
+            elif latest > self.day:
+                f = 0.5 ** ((latest - self.day) / np.timedelta64(1, "D") / self.half_life)
+                self.wsum *= f
+                self.weight *= f
+                self.day = latest
+        w = np.ones(len(days))
+        if self.day is not None:
+            w[dated] = self._decay(days[dated])
+        ok = ~np.isnan(values) & ((lanes >= 1) & (lanes <= 6))[:, None]
+        idx = np.clip(lanes, 1, 6) - 1
+        np.add.at(self.wsum, idx, np.where(ok, values, 0.0) * w[:, None])
+        np.add.at(self.weight, idx, ok * w[:, None])
+        self.rows += len(days)
+
+    def bias(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            place_mean = pd.DataFrame(self.wsum / self.weight, index=pd.Index(LANES, name="艇番"), columns=ITEMS)
+            overall_mean = pd.Series(self.wsum.sum(axis=0) / self.weight.sum(axis=0), index=ITEMS)
+        place_mean = place_mean[self.weight.sum(axis=1) > 0]
+        return _bias_entry(place_mean, overall_mean, self.rows)
+
+
+def _row_arrays(df):
+    days = pd.to_datetime(df["日付"], errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+    lanes = pd.to_numeric(df["艇番"], errors="coerce").fillna(0).to_numpy(dtype=np.int64)
+    return days, lanes, df[ITEMS].to_numpy(dtype=float)
+
+
+@st.cache_resource(max_entries=64)
+def _decay_state(place, race_type, half_life_days):
+    # 会場・種別・半減期ごとの集計状態（プロセス共有、データ版が変わったら追記分だけ進める）
+    return {"lock": threading.Lock(), "sums": DecayedLaneSums(half_life_days), "version": None, "bias": None}
+
+
+def get_decayed_lane_bias(place, race_type, version, half_life_days=DEFAULT_HALF_LIFE_DAYS):
+    # get_lane_bias と同じ形で、時間減衰つきの艇番別平均を返す（会場DBの読込済みデータが対象）
+    state = _decay_state(place, race_type, float(half_life_days))
+    with state["lock"]:
+        if state["version"] != version:
+            sums = state["sums"]
+            # 取り込み済みの最終行が変わっていれば（シートの入れ直しなど）最初から集計し直す
+            if sums.rows and row_key(place, race_type, sums.rows - 1) != sums.last_key:
+                sums = state["sums"] = DecayedLaneSums(half_life_days)
+            new = lane_rows(place, race_type, sums.rows)
+            if len(new):
+                sums.add_rows(*_row_arrays(new))
+                sums.last_key = row_key(place, race_type, sums.rows - 1)
+            state["bias"] = sums.bias() if sums.rows else None
+            state["version"] = version
+        return state["bias"]
+
+
+def corrected_times(input_df, bias):
+    # ② 場平均補正（入力 − 艇番平均 + 全体平均）と ③ 枠番補正込み（さらに − 枠番差）を返す。
+    # 艇番平均の無い艇は入力値のまま
+    offset = bias["lane_bias"].reindex(input_df.index, fill_value=0.0)[ITEMS].to_numpy()
+    adj_df = input_df.copy()
+    final_df = input_df.copy()
+    adj_df[ITEMS] = input_df[ITEMS].to_numpy() - offset
+    final_df[ITEMS] = input_df[ITEMS].to_numpy() - 2 * offset
+    return adj_df, final_df
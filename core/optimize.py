@@ -0,0 +1,182 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.fileio import STATS_DIR, write_atomic
+from core.backtest import DEFAULT_PARAMS, EVAL_MAP, WALK_FORWARD_MIN_RACES, hit_arrays, race_matrix, start_index
+from core.store import connect, lane_stats, race_rows
+
+# ==========================================
+# スタート指数の係数探索（会場・種別ごと、プロセス並列）
+# ==========================================
+# 例: python -m core.optimize                        （グリッド探索）
+#     python -m core.optimize --mode random --samples 2000 --workers 8
+# 結果は 1位的中率 → 上位3艇内率 の順で並べ、最良の設定を
+# stats/start_index_params.json に保存する（スタート予想タブが読み込む）。
+PARAMS_PATH = STATS_DIR / "start_index_params.json"
+EVAL_SYMBOLS = list(EVAL_MAP)
+
+GRID = {
+    "w_tenji": [0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0],
+    "w_isshu": [0.0, 0.1, 0.2, 0.3, 0.5, 0.8],
+    # 評価補正は現在の比率のまま全体の強さだけを振る
+    "eval_scale": [0.0, 0.5, 1.0, 1.5, 2.0],
+}
+RANDOM_RANGES = {
+    "w_tenji": (0.0, 5.0),
+    "w_isshu": (0.0, 1.0),
+    "◎": (0.0, 3.0),
+    "◯": (0.0, 2.0),
+    "△": (-0.5, 1.5),
+    "×": (-3.0, 0.5),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def grid_candidates():
+    for w_t, w_i, scale in itertools.product(GRID["w_tenji"], GRID["w_isshu"], GRID["eval_scale"]):
+        yield {"w_tenji": w_t, "w_isshu": w_i, "eval_map": {k: v * scale for k, v in EVAL_MAP.items()}}
+
+
+def random_candidates(samples, seed=0):
+    rng = np.random.default_rng(seed)
+    yield dict(DEFAULT_PARAMS)
+    for _ in range(samples):
+        r = {k: float(rng.uniform(*lim)) for k, lim in RANDOM_RANGES.items()}
+        yield {"w_tenji": r["w_tenji"], "w_isshu": r["w_isshu"], "eval_map": {s: r[s] for s in EVAL_SYMBOLS}}
+
+
+def score_candidates(m, mean_tenji, mean_isshu, candidates):
+    # 1つの会場の配列に対して候補を順に評価する（各候補は全レース一括の NumPy 計算）
+    results = []
+    for p in candidates:
+        h = hit_arrays(m, start_index(m, mean_tenji, mean_isshu, p))
+        v = h["valid"]
+        n = int(v.sum())
+        if n == 0:
+            continue
+        results.append({
+            **p,
+            "races": n,
+            "hit1": float(h["1位的中"][v].mean() * 100),
+            "hit2": float(h["上位2艇内"][v].mean() * 100),
+            "hit3": float(h["上位3艇内"][v].mean() * 100),
+        })
+    results.sort(key=lambda r: (r["hit1"], r["hit3"]), reverse=True)
+    return results
+
+
+def walk_forward_params(m, window_days, min_races=WALK_FORWARD_MIN_RACES):
+    # 各開催日の係数を、その日より前の window_days 日間のレースだけでグリッドから選び直す
+    # （当日以降のレースを係数選びに使わない）。全候補の的中をレースごとに一度だけ求め、
+    # 日ごとの件数の累積和の差で各窓の 1位的中数 → 上位3艇内数 を比べる。
+    # 戻り値: (start_index に渡すレースごとの係数 (n, 1), 窓内レースが min_races 以上のマスク (n,))
+    day = pd.to_datetime(pd.Series(m["日付"]), errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+    dated = ~np.isnat(day)
+    n = len(day)
+    grid = np.array(list(itertools.product(GRID["w_tenji"], GRID["w_isshu"], GRID["eval_scale"])))
+    params = {
+        "w_tenji": np.full((n, 1), DEFAULT_PARAMS["w_tenji"]),
+        "w_isshu": np.full((n, 1), DEFAULT_PARAMS["w_isshu"]),
+        "eval_map": EVAL_MAP,
+        "eval_scale": np.ones((n, 1)),
+    }
+    use = np.zeros(n, dtype=bool)
+    if not dated.any():
+        return params, use
+
+    days, day_idx = np.unique(day[dated], return_inverse=True)
+
+    def daily_cumsum(weights):
+        return np.concatenate([[0.0], np.cumsum(np.bincount(day_idx, weights=weights, minlength=len(days)))])
+
+    # 窓は [当日 − window_days, 当日) の開催日。会場平均は全艇に同じ量を足すだけなので順位に効かない
+    left = np.searchsorted(days, days - np.timedelta64(int(window_days), "D"), side="left")
+    right = np.arange(len(days))
+    keys = np.empty((len(grid), len(days)))
+    for c, (w_t, w_i, scale) in enumerate(grid):
+        h = hit_arrays(m, start_index(m, 0.0, 0.0, {"w_tenji": w_t, "w_isshu": w_i, "eval_scale": scale}))
+        hit1 = daily_cumsum((h["1位的中"] & h["valid"])[dated].astype(float))
+        hit3 = daily_cumsum((h["上位3艇内"] & h["valid"])[dated].astype(float))
+        keys[c] = (hit1[right] - hit1[left]) * (n + 1) + (hit3[right] - hit3[left])
+        valid = h["valid"]
+    best = grid[np.argmax(keys, axis=0)][day_idx]
+    params["w_tenji"][dated, 0] = best[:, 0]
+    params["w_isshu"][dated, 0] = best[:, 1]
+    params["eval_scale"][dated, 0] = best[:, 2]
+    races = daily_cumsum(valid[dated].astype(float))
+    use[dated] = (races[right] - races[left])[day_idx] >= min_races
+    return params, use
+
+
+def _search_one(job):
+    # ワーカープロセスで1会場・1種別を探索する
+    place, race_type, mode, samples, seed, top = job
+    m = race_matrix(race_rows(place, race_type))
+    _, overall_mean, _ = lane_stats(place, race_type)
+    candidates = grid_candidates() if mode == "grid" else random_candidates(samples, seed)
+    ranked = score_candidates(m, overall_mean["展示"], overall_mean["一周"], candidates)
+    return place, race_type, ranked[:top]
+
+
+def search_all(mode="grid", samples=1000, seed=0, workers=None, top=10):
+    with connect() as con:
+        sources = con.execute("SELECT 会場, 種別 FROM sources ORDER BY 会場, 種別").fetchall()
+    jobs = [(place, race_type, mode, samples, seed, top) for place, race_type in sources]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_search_one, jobs))
+
+
+def save_best_params(results, path=None):
+    data = {"searched_at": datetime.datetime.now().isoformat(timespec="seconds"), "venues": {}}
+    for place, race_type, ranked in results:
+        if ranked:
+            data["venues"].setdefault(place, {})[race_type] = ranked[0]
+    write_atomic(path or PARAMS_PATH, json.dumps(data, ensure_ascii=False, indent=1))
+    return data
+
+
+def load_best_params(place, race_type, path=None):
+    # 保存済みの最良設定（無ければ現行の既定値）。戻り値の "source" で出所を示す
+    path = pathlib.Path(path or PARAMS_PATH)
+    try:
+        best = json.loads(path.read_text(encoding="utf-8"))["venues"][place][race_type]
+    except (OSError, ValueError, KeyError):
+        return {**DEFAULT_PARAMS, "source": "default"}
+    return {
+        "w_tenji": best["w_tenji"],
+        "w_isshu": best["w_isshu"],
+        "eval_map": best["eval_map"],
+        "hit1": best.get("hit1"),
+        "hit3": best.get("hit3"),
+        "source": "optimized",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="スタート指数の係数を会場・種別ごとに探索する")
+    parser.add_argument("--mode", choices=["grid", "random"], default="grid")
+    parser.add_argument("--samples", type=int, default=1000, help="random 時の候補数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=5, help="表示する上位件数")
+    parser.add_argument("--out", default=str(PARAMS_PATH))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = search_all(args.mode, args.samples, args.seed, args.workers, args.top)
+    for place, race_type, ranked in results:
+        for i, r in enumerate(ranked, 1):
+            ev = " ".join(f"{k}{v:+.2f}" for k, v in r["eval_map"].items())
+            print(f"{place}_{race_type} #{i}: 展示×{r['w_tenji']:.2f} 一周×{r['w_isshu']:.2f} [{ev}] "
+                  f"1位 {r['hit1']:.1f}% / 上位3 {r['hit3']:.1f}% ({r['races']}R)")
+    save_best_params(results, args.out)
+    print(f"saved: {args.out}")
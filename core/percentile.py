@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.store import ITEMS, lane_rows
+
+# ==========================================
+# 当日タイムの過去分布でのパーセンタイル（会場 × 艇番 × 項目）
+# ==========================================
+# 読込時（データ版ごとに1回）に艇番・項目ごとの過去タイムを並べ替えておき、
+# 当日の値は searchsorted で位置を求めるだけにする（再実行のたびに履歴を走査しない）。
+# 会場DBの値は float32 なので（6.70 → 6.6999998）、過去・当日とも 0.01 秒単位に丸めて比べる。
+TIME_DECIMALS = 2
+
+
+@st.cache_resource(max_entries=64)
+def shared_sorted_times(place, race_type, version):
+    # {(艇番, 項目): 昇順の過去タイム}
+    df = lane_rows(place, race_type)
+    lanes = pd.to_numeric(df["艇番"], errors="coerce")
+    out = {}
+    for b in range(1, 7):
+        part = df.loc[lanes == b, ITEMS]
+        for c in ITEMS:
+            v = part[c].to_numpy(dtype=float)
+            out[(b, c)] = np.sort(np.round(v[~np.isnan(v)], TIME_DECIMALS))
+    return out
+
+
+def time_percentiles(sorted_times, input_df):
+    # 各入力値より速い（小さい）過去タイムの割合（%）。小さいほど良いタイム。
+    # 未入力（0 または空欄）と過去データが無い艇・項目は NaN
+    out = pd.DataFrame(index=input_df.index, columns=ITEMS, dtype=float)
+    for c in ITEMS:
+        for b in input_df.index:
+            arr = sorted_times.get((int(b), c))
+            v = input_df.loc[b, c]
+            if arr is None or len(arr) == 0 or pd.isna(v) or v <= 0:
+                continue
+            out.loc[b, c] = np.searchsorted(arr, round(float(v), TIME_DECIMALS), side="left") / len(arr) * 100
+    return out
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.backtest import COMBOS, start_index
+from core.backtest_cache import index_params
+from core.history import shared_race_matrix
+
+# ==========================================
+# 着順確率エンジン（Plackett–Luce）
+# ==========================================
+# 各艇の強さ s から「1着は s の比で選ばれ、2着・3着は残りの艇から同じく s の比で選ばれる」
+# として、単勝・2連単30通り・3連単120通りの確率を (レース数 × 組番数) の配列で一括計算する。
+# スタート指数は強さ s = exp(β × 指数) とし、β を会場ごとに過去の 1〜3着から最尤推定する。
+DEFAULT_BETA = 1.0
+BETA_RANGE = (0.0, 20.0)
+
+
+def strengths_from_scores(scores, beta):
+    # 指数 → 強さ（指数の無い艇は強さ0、全艇無ければ均等）
+    x = np.atleast_2d(np.asarray(scores, dtype=float))
+    with np.errstate(invalid="ignore"):
+        z = beta * (x - np.nanmax(np.where(np.isnan(x), -np.inf, x), axis=1, keepdims=True))
+    s = np.nan_to_num(np.exp(z), nan=0.0)
+    s[s.sum(axis=1) == 0] = 1.0
+    return s
+
+
+def pl_probabilities(strength):
+    # strength: (レース数, 6) または (6,)。戻り値は 単勝 (n, 6)・2連単 (n, 30)・3連単 (n, 120)
+    s = np.atleast_2d(np.asarray(strength, dtype=float))
+    total = s.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        win = s / total
+        a, b = COMBOS["2連単"].T
+        exacta = win[:, a] * s[:, b] / (total - s[:, a])
+        a, b, c = COMBOS["3連単"].T
+        trifecta = win[:, a] * s[:, b] / (total - s[:, a]) * s[:, c] / (total - s[:, a] - s[:, b])
+    return {
+        "単勝": np.nan_to_num(win),
+        "2連単": np.nan_to_num(exacta),
+        "3連単": np.nan_to_num(trifecta),
+    }
+
+
+def combo_table(probs, bet, top=10, race=0):
+    # 1レース分の組番を確率の高い順に（艇番は1始まりの表記）
+    p = probs[bet][race]
+    idx = np.argsort(-p, kind="stable")[:top]
+    names = ["-".join(str(int(x) + 1) for x in combo) for combo in COMBOS[bet][idx]]
+    return pd.DataFrame({"組番": names, "確率": p[idx] * 100})
+
+
+def finish_lanes(m):
+    # 1〜3着の艇位置 (n, 3) と、1〜3着が1艇ずつ記録されているレースのマスク
+    place = m["着順"]
+    is_pos = [place == k for k in (1, 2, 3)]
+    valid = np.all([p.sum(axis=1) == 1 for p in is_pos], axis=0)
+    return np.stack([p.argmax(axis=1) for p in is_pos], axis=1), valid
+
+
+def top3_loglik(beta, scores, finish):
+    # 1〜3着の順序の対数尤度（全レースを一括、選ばれた艇を除いた log-sum-exp で桁落ちを防ぐ）
+    x = np.nan_to_num(scores, nan=np.nanmin(scores) if np.isfinite(scores).any() else 0.0)
+    z = beta * x
+    taken = np.zeros(z.shape, dtype=bool)
+    rows = np.arange(len(z))
+    ll = 0.0
+    for k in range(finish.shape[1]):
+        zm = np.where(taken, -np.inf, z)
+        top = zm.max(axis=1)
+        lse = top + np.log(np.exp(zm - top[:, None]).sum(axis=1))
+        ll = ll + z[rows, finish[:, k]] - lse
+        taken[rows, finish[:, k]] = True
+    return float(ll.sum())
+
+
+def fit_beta(scores, finish, lo=BETA_RANGE[0], hi=BETA_RANGE[1], iters=60):
+    # 対数尤度は β について凹なので黄金分割探索で最大化する
+    g = (np.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    c, d = b - g * (b - a), a + g * (b - a)
+    fc, fd = top3_loglik(c, scores, finish), top3_loglik(d, scores, finish)
+    for _ in range(iters):
+        if fc > fd:
+            b, d, fd = d, c, fc
+            c = b - g * (b - a)
+            fc = top3_loglik(c, scores, finish)
+        else:
+            a, c, fc = c, d, fd
+            d = a + g * (b - a)
+            fd = top3_loglik(d, scores, finish)
+    return (a + b) / 2
+
+
+def calibrate_beta(m, mean_tenji, mean_isshu, params=None):
+    # スタート指数の β を過去レースから推定する。戻り値: (β, 使ったレース数, 平均対数尤度)
+    finish, valid = finish_lanes(m)
+    if not valid.any():
+        return DEFAULT_BETA, 0, None
+    scores = start_index(m, mean_tenji, mean_isshu, params)[valid]
+    beta = fit_beta(scores, finish[valid])
+    n = int(valid.sum())
+    return float(beta), n, top3_loglik(beta, scores, finish[valid]) / n
+
+
+@st.cache_resource(max_entries=64)
+def shared_beta(place, race_type, version, mean_tenji, mean_isshu, params):
+    # 会場・種別・データ版・指数係数ごとに1回だけ推定する（プロセス共有）
+    m = shared_race_matrix(place, race_type, version)
+    return calibrate_beta(m, mean_tenji, mean_isshu, index_params(params))
+
+
+def race_day_probabilities(scores, beta=DEFAULT_BETA):
+    # その日の全レース（12R × 6艇の指数）をまとめて確率に変換する。
+    # beta=None のときはスコアそのものを強さとする（予想％・期待値のようにスコア比が1着確率のもの）
+    if beta is None:
+        return pl_probabilities(np.clip(np.atleast_2d(np.asarray(scores, dtype=float)), 0, None))
+    return pl_probabilities(strengths_from_scores(scores, beta))
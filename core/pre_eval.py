@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.store import connect
+
+# ==========================================
+# 事前簡易予想（評価カード）の自動入力
+# ==========================================
+# 会場DBの 艇番・着順・ST から枠番ごとの指標を求め、その会場の「艇番 × 月」ごとの値の
+# 分布（五分位）で ◎○▲△× に割り当てる。データ版ごとに1回だけ計算する。
+# シートに選手の情報は無いので、当地勝率は「その枠の当地での勝率点（1着10点〜6着1点）の平均」とする。
+SYMBOLS = ["◎", "○", "▲", "△", "×"]
+NO_MARK = "無"
+SYMBOL_VALUES = {"◎": 100, "○": 80, "▲": 60, "△": 40, "×": 20, "無": 0}
+WEIGHTS = {
+    "モーター": 0.25,
+    "当地勝率": 0.2,
+    "枠番勝率": 0.3,
+    "枠番スタート": 0.25
+}
+RACE_POINTS = {1: 10, 2: 8, 3: 6, 4: 4, 5: 2, 6: 1}
+RECENT_DAYS = 90        # 現在の値は直近この日数の成績
+MIN_MONTH_ROWS = 20     # 分布に使う「艇番 × 月」の最低件数
+
+# 評価カードの項目 → (指標, 大きいほど良いか)
+MARK_METRICS = {
+    "当地勝率": ("勝率点", True),
+    "枠番勝率": ("1着率", True),
+    "枠番ST": ("平均ST", False),
+}
+
+
+def _metrics(df):
+    finish = df["着順"]
+    return pd.DataFrame({
+        "勝率点": finish.map(RACE_POINTS),
+        "1着率": (finish == 1).astype(float).where(finish.notna()),
+        "平均ST": df["ST"],
+    })
+
+
+def _symbol(value, cuts, higher_is_better):
+    # cuts は 20/40/60/80% 点
+    if pd.isna(value) or cuts is None:
+        return NO_MARK
+    level = int(np.searchsorted(cuts, value, side="right"))  # 0（下位20%）〜4（上位20%）
+    return SYMBOLS[4 - level] if higher_is_better else SYMBOLS[level]
+
+
+def mark_points(values, cuts, higher_is_better):
+    # _symbol の配列版。記号の点数（SYMBOL_VALUES）を返し、値や分布が無ければ 0（無）。
+    # cuts は共通の (4,) か、values (n, 6) の行ごとの (n, 4)
+    values = np.asarray(values, dtype=float)
+    if cuts is None:
+        return np.zeros(values.shape)
+    cuts = np.asarray(cuts, dtype=float)
+    if cuts.ndim == 1:
+        level = np.searchsorted(cuts, values, side="right")
+    else:
+        level = (cuts[:, None, :] <= values[..., None]).sum(axis=-1)
+    points = 20.0 + 20.0 * level if higher_is_better else 100.0 - 20.0 * level
+    return np.where(np.isnan(values), 0.0, points)
+
+
+def lane_marks(place, race_type):
+    # {"marks": {項目: {艇番: 記号}}, "values": 艇番 × 指標の直近値, "cuts": {指標: 五分位点}}
+    with connect() as con:
+        df = pd.read_sql_query(
+            "SELECT 日付, 艇番, 着順, ST FROM races WHERE 会場 = ? AND 種別 = ? AND 艇番 BETWEEN 1 AND 6",
+            con, params=(place, race_type),
+        )
+    df["日付"] = pd.to_datetime(df["日付"], errors="coerce", format="mixed")
+    df = df.dropna(subset=["日付"])
+    marks = {item: {b: NO_MARK for b in range(1, 7)} for item in MARK_METRICS}
+    if df.empty:
+        return {"marks": marks, "values": pd.DataFrame(), "cuts": {}}
+
+    m = _metrics(df)
+    m["艇番"] = df["艇番"].astype(int)
+    m["月"] = df["日付"].dt.to_period("M")
+
+    monthly = m.groupby(["艇番", "月"])
+    sizes = monthly.size()
+    monthly = monthly.mean()[sizes >= MIN_MONTH_ROWS]
+    cuts = {
+        c: (np.nanquantile(monthly[c], [0.2, 0.4, 0.6, 0.8]) if monthly[c].notna().any() else None)
+        for c in ["勝率点", "1着率", "平均ST"]
+    }
+
+    recent = m[df["日付"] >= df["日付"].max() - pd.Timedelta(days=RECENT_DAYS)]
+    values = recent.groupby("艇番")[["勝率点", "1着率", "平均ST"]].mean().reindex(range(1, 7))
+    for item, (metric, higher) in MARK_METRICS.items():
+        for b in range(1, 7):
+            marks[item][b] = _symbol(values.loc[b, metric], cuts[metric], higher)
+    return {"marks": marks, "values": values, "cuts": cuts}
+
+
+@st.cache_resource(max_entries=64)
+def shared_lane_marks(place, race_type, version):
+    return lane_marks(place, race_type)
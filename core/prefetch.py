@@ -0,0 +1,110 @@
+import argparse
+import logging
+import threading
+import time
+
+import streamlit as st
+from gspread.utils import absolute_range_name
+
+from core.sheets import VENUE_SHEET_KEYS, open_spreadsheet
+from core.schema import typed_frame
+from core.snapshot import apply_delta, delta_ranges, snapshot_rows
+from core.store import ingest, source_version
+
+# ==========================================
+# 全会場シートの一括先読み
+# ==========================================
+# スプレッドシートごとに values:batchGet を1回だけ呼び、
+# 全会場の *_混合統計 / *_女子統計 の差分をまとめてスナップショットへ反映する。
+STAT_SUFFIXES = ("_混合統計", "_女子統計")
+PREFETCH_INTERVAL = 600  # 秒
+
+logger = logging.getLogger(__name__)
+
+
+def _batch_values(sh, plan):
+    # plan: {シート名: 取得済み行数}。1回のリクエストで全シート分の範囲を取得する
+    ranges, owners = [], []
+    for title, known in plan.items():
+        for r in delta_ranges(known):
+            ranges.append(absolute_range_name(title, r))
+            owners.append(title)
+
+    values = {title: [] for title in plan}
+    resp = sh.values_batch_get(ranges)
+    for title, vr in zip(owners, resp.get("valueRanges", [])):
+        values[title].append(vr.get("values", []))
+    return values
+
+
+def prefetch_spreadsheet(sheet_key):
+    sh = open_spreadsheet(sheet_key)
+    titles = [ws.title for ws in sh.worksheets() if ws.title.endswith(STAT_SUFFIXES)]
+    if not titles:
+        return []
+
+    plan = {t: snapshot_rows(sheet_key, t) for t in titles}
+    values = _batch_values(sh, plan)
+    results = {t: apply_delta(sheet_key, t, plan[t], values[t]) for t in titles}
+    retry = [t for t, r in results.items() if r is None]
+
+    if retry:
+        # 過去行が修正されていたシートだけ全件取り直す（これもまとめて1回）
+        values = _batch_values(sh, {t: 0 for t in retry})
+        for t in retry:
+            results[t] = apply_delta(sheet_key, t, 0, values[t])
+
+    for t, (df, meta) in results.items():
+        if meta is not None:
+            _ingest_sheet(t, df, meta)
+    return titles
+
+
+def _ingest_sheet(title, raw_df, meta):
+    # "桐生_混合統計" -> ("桐生", "混合") として会場DBにも取り込む
+    place, race_type = title[: -len("統計")].rsplit("_", 1)
+    # 取り込み済みの版なら型変換（全シート分だと数秒かかる）もしない
+    if source_version(place, race_type) == meta["version"]:
+        return
+    ingest(place, race_type, typed_frame(raw_df), meta["version"])
+
+
+def prefetch_all():
+    started = time.perf_counter()
+    done = {}
+    for sheet_key in sorted(set(VENUE_SHEET_KEYS.values())):
+        done[sheet_key] = prefetch_spreadsheet(sheet_key)
+    logger.info("prefetch: %d sheets in %.2fs", sum(len(v) for v in done.values()), time.perf_counter() - started)
+    return done
+
+
+def _prefetch_loop(interval):
+    while True:
+        try:
+            prefetch_all()
+        except Exception:
+            logger.exception("prefetch failed")
+        time.sleep(interval)
+
+
+@st.cache_resource
+def start_prefetch_scheduler(interval=PREFETCH_INTERVAL):
+    # サーバー起動時に1度だけ呼ばれ、以後は interval 秒ごとに差分を先読みする
+    t = threading.Thread(target=_prefetch_loop, args=(interval,), daemon=True, name="sheet-prefetch")
+    t.start()
+    return t
+
+
+if __name__ == "__main__":
+    # 例: python -m core.prefetch            （1回だけ実行）
+    #     python -m core.prefetch --loop 600 （定期実行）
+    parser = argparse.ArgumentParser(description="全会場の統計シートを一括で先読みする")
+    parser.add_argument("--loop", type=int, default=0, help="指定秒ごとに繰り返す")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.loop:
+        _prefetch_loop(args.loop)
+    else:
+        for key, titles in prefetch_all().items():
+            print(f"{key[:8]}: {len(titles)} sheets")
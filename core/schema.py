@@ -0,0 +1,48 @@
+import pandas as pd
+
+# ==========================================
+# レース履歴の列定義（型を1か所で宣言する）
+# ==========================================
+TIME_COLS = ["展示", "直線", "一周", "回り足", "ST"]
+PAYOUT_COLS = ["2連単配当", "3連単配当"]
+CONDITION_COLS = ["風速", "波高"]
+SMALL_INT_COLS = ["艇番", "着順", "レース番号"]
+CATEGORY_COLS = ["評価", "スタート評価", "風向"]
+DATE_COLS = ["日付"]
+
+RACE_SCHEMA = {
+    **{c: "float32" for c in TIME_COLS},
+    **{c: "float32" for c in PAYOUT_COLS},
+    **{c: "float32" for c in CONDITION_COLS},
+    **{c: "Int8" for c in SMALL_INT_COLS},
+    **{c: "category" for c in CATEGORY_COLS},
+    **{c: "datetime64[ns]" for c in DATE_COLS},
+}
+
+
+def _convert(s, dtype):
+    if dtype == "float32":
+        return pd.to_numeric(s, errors="coerce").astype("float32")
+    if dtype == "Int8":
+        # "1R" のような表記も数字だけ取り出す
+        digits = s.astype("string").str.extract(r"(-?\d+)", expand=False)
+        return pd.to_numeric(digits, errors="coerce").astype("Int8")
+    if dtype.startswith("datetime64"):
+        parsed = pd.to_datetime(s.replace("", None), errors="coerce", format="mixed")
+        # 日付として読めない表記が多い場合は元の文字列のまま扱う
+        if parsed.notna().mean() < 0.9:
+            return s.astype("category")
+        return parsed
+    return s.astype(dtype)
+
+
+def typed_frame(raw):
+    # 文字列のままの履歴を宣言済みの型へ一括変換する（宣言外の列はカテゴリ型）
+    cols = {}
+    for c in raw.columns:
+        s = raw[c]
+        if c in PAYOUT_COLS or c in CONDITION_COLS:
+            # "¥1,230" や "3m" のような表記から数字だけ残す
+            s = s.astype("string").str.replace(r"[^0-9.]", "", regex=True)
+        cols[c] = _convert(s, RACE_SCHEMA.get(c, "category"))
+    return pd.DataFrame(cols, index=raw.index)
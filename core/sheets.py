@@ -0,0 +1,92 @@
+import datetime
+import os
+import threading
+import time
+
+import gspread
+import requests
+import streamlit as st
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+
+# ==========================================
+# Google Sheets 共通クライアント
+# ==========================================
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+# 統計シートが入っているスプレッドシート（東: 桐生〜常滑 / 西: 津〜大村）
+SHEET_KEY_EAST = "1lN794iGtyGV2jNwlYzUA8wEbhRwhPM7FxDAkMaoJss4"
+SHEET_KEY_WEST = "1rSzJuk5Hyv60nMwX67pCufXz45HLykyIXuqVE6wtNII"
+
+VENUE_SHEET_KEYS = {
+    "桐生": SHEET_KEY_EAST, "戸田": SHEET_KEY_EAST, "江戸川": SHEET_KEY_EAST, "平和島": SHEET_KEY_EAST,
+    "多摩川": SHEET_KEY_EAST, "浜名湖": SHEET_KEY_EAST, "蒲郡": SHEET_KEY_EAST, "常滑": SHEET_KEY_EAST,
+    "津": SHEET_KEY_WEST, "三国": SHEET_KEY_WEST, "びわこ": SHEET_KEY_WEST, "住之江": SHEET_KEY_WEST,
+    "尼崎": SHEET_KEY_WEST, "鳴門": SHEET_KEY_WEST, "丸亀": SHEET_KEY_WEST, "児島": SHEET_KEY_WEST,
+    "宮島": SHEET_KEY_WEST, "徳山": SHEET_KEY_WEST, "下関": SHEET_KEY_WEST, "若松": SHEET_KEY_WEST,
+    "芦屋": SHEET_KEY_WEST, "福岡": SHEET_KEY_WEST, "唐津": SHEET_KEY_WEST, "大村": SHEET_KEY_WEST,
+}
+
+# トークン期限の何秒前にバックグラウンドで更新するか
+TOKEN_REFRESH_MARGIN = 300
+
+# ローカル代替サーバー（tools/fake_google.py）を使う場合に URL を指定する
+FAKE_GOOGLE_URL = os.environ.get("BOAT_FAKE_GOOGLE", "").rstrip("/")
+SHEETS_API_ORIGIN = "https://sheets.googleapis.com"
+
+
+class _FakeGoogleSession(requests.Session):
+    # gspread の Sheets API 呼び出しをローカル代替サーバーへ振り向ける（認証なし）
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(SHEETS_API_ORIGIN):
+            url = FAKE_GOOGLE_URL + url[len(SHEETS_API_ORIGIN):]
+        return super().request(method, url, *args, **kwargs)
+
+
+def _utcnow():
+    # google-auth の expiry は naive UTC で保持されている
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _keep_token_fresh(creds):
+    # 期限切れ前にトークンを更新し、ページの再実行中に認証通信が発生しないようにする。
+    # リクエスト側（AuthorizedSession → creds.before_request）とはロックを共有しない:
+    # 更新は token / expiry の属性の差し替えだけで、期限の TOKEN_REFRESH_MARGIN 秒前に行うので、
+    # 差し替え途中に読まれた古いトークンもまだ有効なまま
+    while True:
+        expiry = creds.expiry
+        if expiry is None:
+            wait = 60
+        else:
+            wait = (expiry - _utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN
+        time.sleep(max(wait, 30))
+        try:
+            creds.refresh(Request())
+        except Exception:
+            # 一時的な通信エラーは次のループで再試行
+            continue
+
+
+@st.cache_resource
+def get_gspread_client():
+    # プロセス内で1回だけ認証し、全ページ・全セッションで共有する
+    if FAKE_GOOGLE_URL:
+        return gspread.Client(None, session=_FakeGoogleSession(), http_client=gspread.BackOffHTTPClient)
+
+    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=SCOPES)
+    creds.refresh(Request())
+
+    threading.Thread(target=_keep_token_fresh, args=(creds,), daemon=True, name="gspread-token").start()
+    # 429（クォータ超過）や 5xx は指数バックオフで自動再試行する
+    return gspread.authorize(creds, http_client=gspread.BackOffHTTPClient)
+
+
+@st.cache_resource
+def open_spreadsheet(key):
+    return get_gspread_client().open_by_key(key)
+
+
+@st.cache_resource
+def get_worksheet(key, title):
+    # ワークシートのメタデータ取得も1回で済ませる（取得失敗はキャッシュされない）
+    return open_spreadsheet(key).worksheet(title)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.history import shared_race_matrix
+from core.store import ITEMS
+
+# ==========================================
+# 類似レース検索（最近傍）
+# ==========================================
+# 1レースを「6艇 × 4項目（展示・直線・一周・回り足）」の24次元ベクトルにし、
+# 各値から会場の艇番別平均を引いて項目ごとの標準偏差で割る（枠の有利不利を除いた相対値）。
+# 索引はデータ版ごとに1回だけ作り、検索はブロックごとの行列積による総当たり（距離の2乗）。
+SEARCH_BLOCK = 65536
+DEFAULT_NEIGHBORS = 10
+
+
+def _normalizer(m):
+    values = np.stack([m[c] for c in ITEMS], axis=2)  # (n, 6, 項目数)
+    with np.errstate(invalid="ignore"):
+        lane_mean = np.nanmean(values, axis=0)  # (6, 項目数)
+        item_sd = np.nanstd(values - lane_mean, axis=(0, 1))  # (項目数,)
+    return values, np.nan_to_num(lane_mean), np.where(item_sd > 0, item_sd, 1.0)
+
+
+def _vectors(values, lane_mean, item_sd):
+    # 欠損は平均（0）扱い
+    z = (values - lane_mean) / item_sd
+    return np.nan_to_num(z).reshape(len(values), -1).astype(np.float32)
+
+
+def _finish(m):
+    # 1〜3着の艇番を "1-2-3" 形式で
+    place = np.nan_to_num(m["着順"], nan=0)
+    order = np.argsort(np.where(place > 0, place, 99), axis=1, kind="stable")[:, :3] + 1
+    return np.array(["-".join(map(str, r)) for r in order])
+
+
+@st.cache_resource(max_entries=32)
+def shared_similar_index(place, race_type, version):
+    # 会場・種別・データ版ごとの検索用索引（ベクトル・ノルム・表示用の付帯情報）
+    m = shared_race_matrix(place, race_type, version)
+    values, lane_mean, item_sd = _normalizer(m)
+    x = _vectors(values, lane_mean, item_sd)
+    return {
+        "x": x,
+        "sq_norm": (x * x).sum(axis=1),
+        "lane_mean": lane_mean,
+        "item_sd": item_sd,
+        "日付": m["日付"],
+        "R": m["レース番号"],
+        "着順": _finish(m),
+        "1着艇": np.argmax(m["着順"] == 1, axis=1) + 1,
+    }
+
+
+def nearest_races(index, input_df, k=DEFAULT_NEIGHBORS, block=SEARCH_BLOCK):
+    # 当日入力（艇番 × 項目）に近い過去レース k 件（距離の近い順）。
+    # 未入力（0 または空欄）の艇・項目は距離に含めない
+    n = len(index["x"])
+    today = input_df.reindex(range(1, 7))[ITEMS].to_numpy(dtype=float)[None]
+    today = np.where(today > 0, today, np.nan)
+    entered = ~np.isnan(today).reshape(-1)
+    if n == 0 or not entered.any():
+        return pd.DataFrame(columns=["日付", "R", "着順", "1着艇", "距離"])
+    q = _vectors(today, index["lane_mean"], index["item_sd"])[0]
+    mask = entered.astype(np.float32)
+    k = min(k, n)
+    best_d = np.empty(0, dtype=np.float32)
+    best_i = np.empty(0, dtype=np.int64)
+    for start in range(0, n, block):
+        xb = index["x"][start:start + block]
+        sq = index["sq_norm"][start:start + block] if entered.all() else np.einsum("ij,ij,j->i", xb, xb, mask)
+        d = sq - 2 * (xb @ q) + q @ q
+        kb = min(k, len(d))
+        part = np.argpartition(d, kb - 1)[:kb]
+        best_d = np.concatenate([best_d, d[part]])
+        best_i = np.concatenate([best_i, part + start])
+        keep = np.argsort(best_d, kind="stable")[:k]
+        best_d, best_i = best_d[keep], best_i[keep]
+    return pd.DataFrame({
+        "日付": index["日付"][best_i],
+        "R": index["R"][best_i],
+        "着順": index["着順"][best_i],
+        "1着艇": index["1着艇"][best_i],
+        "距離": np.sqrt(np.maximum(best_d, 0)),
+    })
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from core.backtest import COMBOS, DEFAULT_PARAMS, input_matrix, start_index
+from core.backtest_cache import index_params
+from core.store import lane_spread
+
+# ==========================================
+# モンテカルロによる着順シミュレーション
+# ==========================================
+# 各艇の ST・展示・一周を「当日の入力値 ± 会場・艇番ごとの過去のばらつき」で揺らし、
+# スタート指数の順に着順を決めるレースを大量に繰り返す。
+# 指数は3項目の一次式なので、3つの正規乱数の和は1つの正規乱数
+#   σ = √(σ_ST² + (w_展示 σ_展示)² + (w_一周 σ_一周)²)
+# にまとめられる（1レースあたり6個の乱数で済む）。1〜3着の組をまとめて数え、
+# 単勝・2着内・3着内・2連単・3連単の確率を求める。
+DEFAULT_SIMULATIONS = 1_000_000
+BATCH_SIZE = 250_000
+DEFAULT_SEED = 0
+SPREAD_COLS = ["ST", "展示", "一周"]
+
+
+@st.cache_resource(max_entries=64)
+def shared_lane_spread(place, race_type, version):
+    # 艇番別の標準偏差（データ版ごとに1回だけ集計）
+    return lane_spread(place, race_type, tuple(SPREAD_COLS))
+
+
+def score_spread(spread, params=None):
+    # 艇ごとの指数のばらつき σ（(6,)、過去データの無い艇は全艇の中央値）
+    p = index_params(params or DEFAULT_PARAMS)
+    sd = spread.reindex(range(1, 7))
+    sigma = np.sqrt(sd["ST"] ** 2 + (p["w_tenji"] * sd["展示"]) ** 2 + (p["w_isshu"] * sd["一周"]) ** 2).to_numpy()
+    fill = np.nanmedian(sigma) if np.isfinite(sigma).any() else 0.1
+    return np.where(np.isfinite(sigma), sigma, fill)
+
+
+def simulate_finishes(base, sigma, n=DEFAULT_SIMULATIONS, seed=DEFAULT_SEED, batch=BATCH_SIZE):
+    # base: 各艇の指数 (6,)、sigma: ばらつき (6,)。1〜3着の組ごとの回数 (6×6×6) から確率を返す
+    rng = np.random.default_rng(seed)
+    base = np.nan_to_num(np.asarray(base, dtype=np.float32), nan=-np.inf)
+    sigma = np.asarray(sigma, dtype=np.float32)
+    counts = np.zeros(216, dtype=np.int64)
+    for start in range(0, n, batch):
+        k = min(batch, n - start)
+        score = base + sigma * rng.standard_normal((k, 6), dtype=np.float32)
+        order = np.argsort(-score, axis=1)[:, :3]
+        counts += np.bincount(order[:, 0] * 36 + order[:, 1] * 6 + order[:, 2], minlength=216)
+    p3 = counts.reshape(6, 6, 6) / n
+    win = p3.sum(axis=(1, 2))
+    second = p3.sum(axis=(0, 2))
+    third = p3.sum(axis=(0, 1))
+    a, b = COMBOS["2連単"].T
+    x, y, z = COMBOS["3連単"].T
+    return {
+        "単勝": win,
+        "2着内": win + second,
+        "3着内": win + second + third,
+        "2連単": p3.sum(axis=2)[a, b],
+        "3連単": p3[x, y, z],
+        "n": n,
+    }
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_simulation(tenji, isshu, st_, evals, mean_tenji, mean_isshu, params, sigma, n=DEFAULT_SIMULATIONS):
+    # 入力が同じなら再実行しない（引数はすべてタプル・数値・dict）
+    p = index_params(params)
+    base = start_index(input_matrix(tenji, isshu, st_, evals), mean_tenji, mean_isshu, p)[0]
+    return simulate_finishes(base, np.asarray(sigma), n)
+
+
+def finish_table(sim):
+    # 艇番ごとの 1着・2着内・3着内 率（%）
+    return pd.DataFrame({
+        "艇番": range(1, 7),
+        "1着率": sim["単勝"] * 100,
+        "2着内率": sim["2着内"] * 100,
+        "3着内率": sim["3着内"] * 100,
+    })
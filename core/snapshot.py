@@ -0,0 +1,124 @@
+import datetime
+import hashlib
+import json
+
+import pandas as pd
+
+from core.fileio import CACHE_DIR, atomic_path
+
+# ==========================================
+# 統計シートのローカルスナップショット（差分同期）
+# ==========================================
+# シートは日付・レース番号順に追記されるだけのログなので、
+# 手元の行数より後ろだけを取得すれば全件と一致する。
+SNAPSHOT_DIR = CACHE_DIR / "snapshots"
+
+# 追記のみであることを確認するためのキー列
+KEY_COLS = ["日付", "レース番号", "艇番"]
+
+
+def _paths(sheet_key, title):
+    stem = f"{sheet_key[:8]}_{title}"
+    return SNAPSHOT_DIR / f"{stem}.parquet", SNAPSHOT_DIR / f"{stem}.json"
+
+
+def _data_version(title, df):
+    # 行数と最終行の内容からデータ版を決める（追記があれば必ず変わる）
+    last = df.iloc[-1].fillna("").tolist() if len(df) else []
+    src = json.dumps([title, len(df), last], ensure_ascii=False)
+    return hashlib.sha1(src.encode("utf-8")).hexdigest()[:12]
+
+
+def _pad(rows, width):
+    # Sheets API は末尾の空セルを省略して返すので列数を揃える
+    return [list(r[:width]) + [""] * (width - len(r)) for r in rows]
+
+
+def _to_frame(header, rows):
+    return pd.DataFrame(_pad(rows, len(header)), columns=header, dtype="string")
+
+
+def _save(sheet_key, title, df):
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = _paths(sheet_key, title)
+    meta = {
+        "title": title,
+        "header": list(df.columns),
+        "rows": len(df),
+        "version": _data_version(title, df),
+        "synced_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    # 本体を置き換えてからメタデータを置き換える（内側の with から先に置き換わる）
+    with atomic_path(meta_path) as tmp_meta, atomic_path(data_path) as tmp_data:
+        df.to_parquet(tmp_data, index=False)
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return df, meta
+
+
+def load_snapshot(sheet_key, title):
+    # 通信なしで手元のスナップショットを返す（無ければ None）
+    data_path, meta_path = _paths(sheet_key, title)
+    if not data_path.exists() or not meta_path.exists():
+        return None, None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        df = pd.read_parquet(data_path)
+    except Exception:
+        return None, None
+    return df, meta
+
+
+def snapshot_rows(sheet_key, title):
+    # 手元のスナップショットの行数（無ければ 0）
+    df, meta = load_snapshot(sheet_key, title)
+    return 0 if df is None else meta["rows"]
+
+
+def delta_ranges(known):
+    # 差分取得に必要な範囲。known 行まで取得済みなら、ヘッダーと最終既知行以降だけ
+    if not known:
+        return ["A:ZZ"]
+    return ["1:1", f"A{known + 1}:ZZ"]
+
+
+def apply_delta(sheet_key, title, known, values_list):
+    # delta_ranges(known) で取得した値をスナップショットに反映して返す。
+    # 過去行の修正や列構成の変更を検出した場合は None（全件取り直しが必要）
+    if not known:
+        values = values_list[0]
+        if not values:
+            return pd.DataFrame(), None
+        return _save(sheet_key, title, _to_frame(values[0], values[1:]))
+
+    df, meta = load_snapshot(sheet_key, title)
+    if df is None or meta["rows"] != known:
+        return None
+
+    header = meta["header"]
+    head_range, tail_range = values_list
+    tail = _pad(list(tail_range), len(header))
+
+    cur_header = list(head_range[0]) if head_range else []
+    overlap_ok = bool(tail) and all(
+        tail[0][header.index(c)] == df.iloc[-1][c] for c in KEY_COLS if c in header
+    )
+    if cur_header != header or not overlap_ok:
+        return None
+
+    new_rows = [r for r in tail[1:] if any(v != "" for v in r)]
+    if not new_rows:
+        return df, meta
+
+    merged = pd.concat([df, _to_frame(header, new_rows)], ignore_index=True)
+    return _save(sheet_key, title, merged)
+
+
+def sync_snapshot(ws, sheet_key, title):
+    # 手元のスナップショットに、シート側で増えた行だけを追記して返す
+    known = snapshot_rows(sheet_key, title)
+    # 1行目（ヘッダー）と「最後に取得済みの行」以降を1回のリクエストで取得
+    result = apply_delta(sheet_key, title, known, ws.batch_get(delta_ranges(known)))
+    if result is None:
+        # 列構成の変更や過去行の修正があった場合は全件取り直す
+        result = apply_delta(sheet_key, title, 0, ws.batch_get(delta_ranges(0)))
+    return result
@@ -0,0 +1,238 @@
+import contextlib
+import pathlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+from core.fileio import CACHE_DIR
+
+# ==========================================
+# 全会場のレース履歴をまとめた埋め込みDB（SQLite）
+# ==========================================
+# 会場ページ・pro_app の集計はここへの索引付きクエリで行う。
+# シート（スナップショット）からは追記分だけを取り込む。
+DB_PATH = CACHE_DIR / "races.sqlite3"
+
+ITEMS = ["展示", "直線", "一周", "回り足"]
+STORE_COLS = [
+    "日付", "レース番号", "艇番", "展示", "直線", "一周", "回り足", "ST", "着順", "評価", "スタート評価",
+    "2連単配当", "3連単配当", "風向", "風速", "波高",
+]
+# 数値でない列（_migrate で列を追加するときの型）
+TEXT_COLS = ["日付", "評価", "スタート評価", "風向"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    会場 TEXT NOT NULL,
+    種別 TEXT NOT NULL,
+    行番号 INTEGER NOT NULL,
+    日付 TEXT,
+    レース番号 INTEGER,
+    艇番 INTEGER,
+    展示 REAL, 直線 REAL, 一周 REAL, 回り足 REAL, ST REAL,
+    着順 INTEGER,
+    評価 TEXT,
+    スタート評価 TEXT,
+    "2連単配当" REAL, "3連単配当" REAL,
+    風向 TEXT, 風速 REAL, 波高 REAL,
+    PRIMARY KEY (会場, 種別, 行番号)
+);
+CREATE INDEX IF NOT EXISTS idx_races_key ON races (会場, 日付, レース番号, 艇番);
+CREATE INDEX IF NOT EXISTS idx_races_lane ON races (会場, 種別, 艇番);
+CREATE TABLE IF NOT EXISTS sources (
+    会場 TEXT NOT NULL,
+    種別 TEXT NOT NULL,
+    version TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    PRIMARY KEY (会場, 種別)
+);
+"""
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+@contextlib.contextmanager
+def connect(db_path=None):
+    # スレッドごとに接続を開く（WAL なので読み書きが並行できる）
+    path = pathlib.Path(db_path or DB_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(path, timeout=30)
+    try:
+        with _init_lock:
+            if str(path) not in _initialized:
+                con.execute("PRAGMA journal_mode=WAL")
+                con.executescript(_SCHEMA)
+                _migrate(con)
+                _initialized.add(str(path))
+        yield con
+        con.commit()
+    finally:
+        con.close()
+
+
+def _migrate(con):
+    # 後から増えた列を既存のDBに追加し、全シートを次回の取り込みで入れ直す
+    have = {r[1] for r in con.execute("PRAGMA table_info(races)")}
+    missing = [c for c in STORE_COLS if c not in have]
+    for c in missing:
+        con.execute(f'ALTER TABLE races ADD COLUMN "{c}" {"TEXT" if c in TEXT_COLS else "REAL"}')
+    if missing:
+        con.execute("DELETE FROM sources")
+
+
+def _to_rows(place, race_type, df, offset):
+    # df の各行を races テーブルの行（行番号は offset から）に変換する
+    cols = {}
+    for c in STORE_COLS:
+        if c not in df.columns:
+            cols[c] = [None] * len(df)
+            continue
+        s = df[c]
+        if c == "日付" and pd.api.types.is_datetime64_any_dtype(s):
+            s = s.dt.strftime("%Y-%m-%d")
+        cols[c] = s.astype(object).where(s.notna(), None).tolist()
+    return [
+        (place, race_type, offset + i, *[cols[c][i] for c in STORE_COLS])
+        for i in range(len(df))
+    ]
+
+
+def source_version(place, race_type):
+    # 取り込み済みのデータ版（未取り込みなら None）
+    with connect() as con:
+        row = con.execute(
+            "SELECT version FROM sources WHERE 会場 = ? AND 種別 = ?", (place, race_type)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def ingest(place, race_type, typed_df, version):
+    # スナップショットは追記のみなので、取り込み済みの行数より後ろだけを追加する
+    columns = ", ".join(f'"{c}"' for c in STORE_COLS)
+    with connect() as con:
+        row = con.execute(
+            "SELECT version, rows FROM sources WHERE 会場 = ? AND 種別 = ?", (place, race_type)
+        ).fetchone()
+        if row and row[0] == version:
+            return 0
+        start = row[1] if row and row[1] <= len(typed_df) else 0
+        if start == 0:
+            con.execute("DELETE FROM races WHERE 会場 = ? AND 種別 = ?", (place, race_type))
+        else:
+            # 取り込み済み範囲の最終行が変わっていれば（列の追加を含めて）全件入れ直す
+            last = con.execute(
+                f"SELECT {columns} FROM races WHERE 会場 = ? AND 種別 = ? AND 行番号 = ?",
+                (place, race_type, start - 1),
+            ).fetchone()
+            expected = _to_rows(place, race_type, typed_df.iloc[start - 1:start], start - 1)[0][3:]
+            if last is None or tuple(last) != tuple(expected):
+                start = 0
+                con.execute("DELETE FROM races WHERE 会場 = ? AND 種別 = ?", (place, race_type))
+
+        placeholders = ",".join(["?"] * (len(STORE_COLS) + 3))
+        rows = _to_rows(place, race_type, typed_df.iloc[start:], start)
+        con.executemany(
+            f"INSERT OR REPLACE INTO races (会場, 種別, 行番号, {columns}) VALUES ({placeholders})",
+            rows,
+        )
+        con.execute(
+            "INSERT OR REPLACE INTO sources (会場, 種別, version, rows) VALUES (?, ?, ?, ?)",
+            (place, race_type, version, len(typed_df)),
+        )
+        return len(rows)
+
+
+def lane_stats(place, race_type):
+    # 艇番ごとの平均（place_mean）、全体平均（overall_mean）、レース数を1回のクエリ群で返す
+    avg_cols = ", ".join(f"AVG({c}) AS {c}" for c in ITEMS)
+    with connect() as con:
+        place_mean = pd.read_sql_query(
+            f"SELECT 艇番, {avg_cols} FROM races WHERE 会場 = ? AND 種別 = ? AND 艇番 IS NOT NULL GROUP BY 艇番 ORDER BY 艇番",
+            con, params=(place, race_type), index_col="艇番",
+        )
+        overall = pd.read_sql_query(
+            f"SELECT COUNT(*) AS n, {avg_cols} FROM races WHERE 会場 = ? AND 種別 = ?",
+            con, params=(place, race_type),
+        )
+    n_rows = int(overall.pop("n").iloc[0])
+    overall_mean = overall.iloc[0].astype(float)
+    return place_mean, overall_mean, n_rows
+
+
+def lane_spread(place, race_type, cols=("ST", "展示", "一周")):
+    # 艇番ごとの標準偏差（合計と二乗和から求める）
+    select = ", ".join(f"COUNT({c}) AS {c}_n, SUM({c}) AS {c}_s, SUM({c} * {c}) AS {c}_ss" for c in cols)
+    with connect() as con:
+        df = pd.read_sql_query(
+            f"SELECT 艇番, {select} FROM races WHERE 会場 = ? AND 種別 = ? AND 艇番 BETWEEN 1 AND 6 "
+            "GROUP BY 艇番 ORDER BY 艇番",
+            con, params=(place, race_type), index_col="艇番",
+        )
+    out = pd.DataFrame(index=df.index)
+    for c in cols:
+        n, s, ss = df[f"{c}_n"], df[f"{c}_s"], df[f"{c}_ss"]
+        out[c] = (((ss - s * s / n) / (n - 1)).clip(lower=0) ** 0.5).where(n > 1)
+    return out
+
+
+def lane_rows(place, race_type, start=0):
+    # 行番号 start 以降の艇番別タイム（取り込み順）。時間減衰の集計を追記分だけ進めるのに使う
+    sql = f"""
+        SELECT 行番号, 日付, 艇番, {', '.join(ITEMS)} FROM races
+        WHERE 会場 = ? AND 種別 = ? AND 行番号 >= ?
+        ORDER BY 行番号
+    """
+    with connect() as con:
+        return pd.read_sql_query(sql, con, params=(place, race_type, start))
+
+
+def row_key(place, race_type, row_no):
+    # 指定行の (日付, レース番号, 艇番)。無ければ None
+    with connect() as con:
+        row = con.execute(
+            "SELECT 日付, レース番号, 艇番 FROM races WHERE 会場 = ? AND 種別 = ? AND 行番号 = ?",
+            (place, race_type, row_no),
+        ).fetchone()
+    return tuple(row) if row else None
+
+
+def race_rows(place, race_type):
+    # 6艇揃い、1着が記録されているレースだけを日付・レース番号順に返す
+    sql = f"""
+        WITH complete AS (
+            SELECT 日付, レース番号 FROM races
+            WHERE 会場 = ? AND 種別 = ?
+            GROUP BY 日付, レース番号
+            HAVING COUNT(*) >= 6 AND SUM(着順 = 1) >= 1
+        )
+        SELECT r.日付, r.レース番号, r.艇番, r.展示, r.直線, r.一周, r.回り足, r.ST, r.着順, r.評価, r.スタート評価,
+               r."2連単配当", r."3連単配当"
+        FROM races r JOIN complete c ON r.日付 = c.日付 AND r.レース番号 = c.レース番号
+        WHERE r.会場 = ? AND r.種別 = ?
+        ORDER BY r.日付, r.レース番号, r.艇番
+    """
+    with connect() as con:
+        return pd.read_sql_query(sql, con, params=(place, race_type, place, race_type))
+
+
+def venue_summary(race_type="混合"):
+    # pro_app の会場比較表（展示1位の1着率・3連対率、イン逃げ率、サンプル数）
+    sql = """
+        WITH ranked AS (
+            SELECT 会場, 艇番, 着順,
+                   RANK() OVER (PARTITION BY 会場, 日付, レース番号 ORDER BY 展示) AS 展示順位
+            FROM races
+            WHERE 種別 = ? AND 着順 IS NOT NULL AND 展示 IS NOT NULL
+        )
+        SELECT 会場 AS 会場名,
+               ROUND(100.0 * AVG(CASE WHEN 展示順位 = 1 THEN 着順 = 1 END), 1) AS 展示信頼度,
+               ROUND(100.0 * AVG(CASE WHEN 展示順位 = 1 THEN 着順 <= 3 END), 1) AS 展示貢献度,
+               ROUND(100.0 * AVG(CASE WHEN 艇番 = 1 THEN 着順 = 1 END), 1) AS イン逃げ率,
+               COUNT(*) AS サンプル数
+        FROM ranked
+        GROUP BY 会場
+    """
+    with connect() as con:
+        return pd.read_sql_query(sql, con, params=(race_type,))
@@ -0,0 +1,105 @@
+import datetime
+import json
+import logging
+import os
+import pathlib
+
+import pandas as pd
+import streamlit as st
+
+from core.fileio import STATS_DIR, stats_cli, write_atomic
+from core.store import ITEMS, connect
+
+# ==========================================
+# 会場別統計の事前集計スナップショット（オフライン CLI で作成）
+# ==========================================
+# 例: python -m core.venue_stats            （全シートを同期してから集計）
+#     python -m core.venue_stats --no-sync  （会場DBにある分だけで集計）
+# 会場ページは履歴を読み込まなくても、このファイル（数十KB）だけで
+# 統計解析・スタート予想・項目別順位のタブを表示できる。
+STATS_PATH = STATS_DIR / "venue_stats.json"
+STATS_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _moments(con, where, params, group_by=None):
+    # 件数・平均・不偏分散を SQL の合計値から求める
+    select = ", ".join(
+        f"COUNT({c}) AS {c}_n, SUM({c}) AS {c}_s, SUM({c} * {c}) AS {c}_ss" for c in ITEMS
+    )
+    key = f"{group_by}, " if group_by else ""
+    tail = f" GROUP BY {group_by} ORDER BY {group_by}" if group_by else ""
+    df = pd.read_sql_query(f"SELECT {key}{select} FROM races WHERE {where}{tail}", con, params=params)
+    out = {}
+    for _, row in df.iterrows():
+        entry = {}
+        for c in ITEMS:
+            n, s, ss = row[f"{c}_n"], row[f"{c}_s"], row[f"{c}_ss"]
+            mean = float(s / n) if n else None
+            var = float((ss - s * s / n) / (n - 1)) if n and n > 1 else None
+            entry[c] = {"n": int(n), "mean": mean, "var": var}
+        out[int(row[group_by]) if group_by else "all"] = entry
+    return out
+
+
+def build_venue_stats():
+    venues = {}
+    with connect() as con:
+        sources = con.execute("SELECT 会場, 種別, version, rows FROM sources ORDER BY 会場, 種別").fetchall()
+        for place, race_type, version, rows in sources:
+            where, params = "会場 = ? AND 種別 = ?", (place, race_type)
+            lanes = _moments(con, f"{where} AND 艇番 BETWEEN 1 AND 6", params, group_by="艇番")
+            overall = _moments(con, where, params)["all"]
+            venues.setdefault(place, {})[race_type] = {
+                "version": version,
+                "rows": rows,
+                "races": rows // 6,
+                "overall": overall,
+                "lanes": {str(b): v for b, v in lanes.items()},
+            }
+    return {
+        "format": STATS_FORMAT,
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "venues": venues,
+    }
+
+
+def write_venue_stats(stats, path=None):
+    write_atomic(path or STATS_PATH, json.dumps(stats, ensure_ascii=False, separators=(",", ":")))
+
+
+@st.cache_resource
+def _load_venue_stats(path, mtime):
+    # ファイルが更新されたら（mtime が変われば）読み直す
+    data = json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+    return data if data.get("format") == STATS_FORMAT else None
+
+
+def load_venue_stats(path=None):
+    path = pathlib.Path(path or STATS_PATH)
+    if not path.exists():
+        return None
+    return _load_venue_stats(str(path), path.stat().st_mtime)
+
+
+def snapshot_lane_stats(place, race_type):
+    # core.store.lane_stats と同じ形 (place_mean, overall_mean, 行数) で返す。無ければ None
+    stats = load_venue_stats()
+    entry = (stats or {}).get("venues", {}).get(place, {}).get(race_type)
+    if not entry:
+        return None
+    place_mean = pd.DataFrame(
+        {c: {int(b): v[c]["mean"] for b, v in entry["lanes"].items()} for c in ITEMS}
+    ).sort_index()
+    place_mean.index.name = "艇番"
+    overall_mean = pd.Series({c: entry["overall"][c]["mean"] for c in ITEMS}, dtype=float)
+    return place_mean, overall_mean, entry["rows"]
+
+
+if __name__ == "__main__":
+    args = stats_cli("会場別統計の事前集計スナップショットを作成する", out=STATS_PATH)
+    stats = build_venue_stats()
+    write_venue_stats(stats, args.out)
+    n = sum(len(v) for v in stats["venues"].values())
+    print(f"{args.out}: {n} sheets, {os.path.getsize(args.out) / 1024:.1f} KB")
@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import os
-import gspread  # ← これを追加！
 import base64   # (もし画像表示を使うならこれも必要)
 
 # ==============================
@@ -25,17 +24,28 @@ st.set_page_config(page_title=f"競艇Pro {PLACE_NAME}", layout="wide")
 st.title(f"🚀 {PLACE_NAME} 解析システム")
 
 # ======================================
-# 2. Google接続準備 (gcの定義をここで行う)
+# 2. Google接続準備 (プロセス共有のクライアントを使う)
 # ======================================
-from google.oauth2.service_account import Credentials
-import gspread
-
-scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+from core.sheets import VENUE_SHEET_KEYS, get_gspread_client, get_worksheet
+from core.backtest import WALK_FORWARD_MIN_RACES
+from core.backtest_cache import cached_backtest, cached_combo_backtest
+from core.optimize import load_best_params
+from core.calibration import recalibrate, shared_calibration
+from core.pre_eval import NO_MARK, RECENT_DAYS, SYMBOL_VALUES, WEIGHTS, shared_lane_marks
+from core.percentile import shared_sorted_times, time_percentiles
+from core.plackett_luce import DEFAULT_BETA, combo_table, race_day_probabilities, shared_beta
+from core.similar import nearest_races, shared_similar_index
+from core.simulate import cached_simulation, finish_table, score_spread, shared_lane_spread
+from core.history import history_ref, shared_race_matrix
+from core.schema import typed_frame
+from core.snapshot import load_snapshot, sync_snapshot
+from core.store import ingest, source_version
+from core.conditions import MIN_CELL_ROWS, WIND_DIRS, apply_condition_offsets, condition_offsets
+from core.lane_bias import DEFAULT_HALF_LIFE_DAYS, corrected_times, get_decayed_lane_bias, get_lane_bias
 
 try:
-    # secrets から認証情報を取得して gc を作成
-    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
-    gc = gspread.authorize(creds)
+    # 認証は初回のみ。以降の再実行では認証通信は発生しない
+    get_gspread_client()
 except Exception as e:
     st.error(f"Google接続設定エラー: {e}")
     st.stop()
@@ -54,23 +64,35 @@ with st.container(border=True):
     
     with c2:
         target_sheet = f"{PLACE_NAME}_{race_type_val}統計"
+        sheet_key = VENUE_SHEET_KEYS[PLACE_NAME]
+
+        def apply_base_df(raw_df, meta):
+            # セッションには参照（シート名・データ版）だけを持ち、各タブは会場DBへのクエリで集計する
+            st.session_state["tab2_data_ref"] = history_ref(sheet_key, target_sheet, meta)
+            # 全会場共通のDBへ追記分だけ取り込む。取り込み済みの版なら型変換もしない
+            if source_version(PLACE_NAME, race_type_val) != meta["version"]:
+                ingest(PLACE_NAME, race_type_val, typed_frame(raw_df), meta["version"])
+
+        # 種別を切り替えたら、前のシートのデータ版は使わずに選んだシートを当て直す
+        loaded_ref = st.session_state.get("tab2_data_ref")
+        if loaded_ref is not None and loaded_ref["title"] != target_sheet:
+            del st.session_state["tab2_data_ref"]
+
+        # 手元にスナップショットがあれば通信せずに即表示
+        if "tab2_data_ref" not in st.session_state:
+            snap_df, snap_meta = load_snapshot(sheet_key, target_sheet)
+            if snap_df is not None and not snap_df.empty:
+                apply_base_df(snap_df, snap_meta)
+
         if st.button(f"🔄 {target_sheet} を読み込む", use_container_width=True, key="top_load_btn"):
-            with st.spinner("データ取得中..."):
+            with st.spinner("差分データ取得中..."):
                 try:
-                    # 福岡と下関で共通のシートIDを使用
-                    sh = gc.open_by_key("1rSzJuk5Hyv60nMwX67pCufXz45HLykyIXuqVE6wtNII")
-                    ws = sh.worksheet(target_sheet)
-                    data = ws.get_all_records()
-                    
-                    if data:
-                        df = pd.DataFrame(data)
-                        # 数値型変換
-                        num_cols = ["展示", "直線", "一周", "回り足", "艇番", "ST", "着順"]
-                        for c in num_cols:
-                            if c in df.columns:
-                                df[c] = pd.to_numeric(df[c], errors="coerce")
-                        
-                        st.session_state["tab2_base_df"] = df
+                    # 前回取得以降に追記された行だけを取得してスナップショットに追加
+                    ws = get_worksheet(sheet_key, target_sheet)
+                    df, snap_meta = sync_snapshot(ws, sheet_key, target_sheet)
+
+                    if not df.empty:
+                        apply_base_df(df, snap_meta)
                         st.toast(f"✅ {target_sheet} を適用しました")
                     else:
                         st.error("シートにデータがありません")
@@ -78,20 +100,47 @@ with st.container(border=True):
                     st.error(f"読込失敗: {e}")
 
     with c3:
-        if "tab2_base_df" in st.session_state:
-            count = len(st.session_state["tab2_base_df"])
+        if "tab2_data_ref" in st.session_state:
+            count = st.session_state["tab2_data_ref"]["rows"]
             st.success(f"適用中: {target_sheet} ({count}件)")
         else:
             st.warning("⚠️ データ未読込です")
 
     with c3:
-        if "tab2_base_df" in st.session_state:
-            count = len(st.session_state["tab2_base_df"])
+        if "tab2_data_ref" in st.session_state:
+            count = st.session_state["tab2_data_ref"]["rows"]
             st.success(f"適用中: {target_sheet} ({count}件)")
         else:
             st.warning("⚠️ データ未読込です")
 
+# 艇番別平均の重み付け（補正表・スタート指数の両方に効く）
+# 直近重視は会場DBの日付付きの行から集計するので、データ読込前は選べない
+bias_loaded = st.session_state.get("tab2_data_ref") is not None
+bias_c1, bias_c2 = st.columns([2, 1])
+with bias_c1:
+    lane_bias_mode = st.radio(
+        "艇番別平均の集計", ["全期間平均", "直近重視（時間減衰）"], horizontal=True, key="lane_bias_mode",
+        disabled=not bias_loaded,
+    )
+with bias_c2:
+    half_life_days = st.number_input(
+        "半減期（日）", min_value=7, max_value=3650, value=DEFAULT_HALF_LIFE_DAYS, step=30,
+        key="lane_bias_half_life", disabled=not bias_loaded or lane_bias_mode == "全期間平均",
+    )
+if not bias_loaded:
+    st.caption("※ データ読込前は事前集計の全期間平均を使います（直近重視は読込後に選べます）")
+
 st.divider()
+
+def get_lane_stats():
+    # 読込済みなら会場DB、未読込なら事前集計スナップショット（数KB）の艇番別統計を使う
+    # （データ版ごとにプロセスで1回だけ集計し、各タブは同じ結果を参照する）
+    ref = st.session_state.get("tab2_data_ref")
+    if ref and lane_bias_mode != "全期間平均":
+        # 直近重視: 半減期ごとの重み付き合計を追記分だけ更新したもの
+        return get_decayed_lane_bias(PLACE_NAME, race_type_val, ref["version"], half_life_days)
+    return get_lane_bias(PLACE_NAME, race_type_val, ref["version"] if ref else None)
+
 # ======================================
 # 3. タブの定義
 # ======================================
@@ -109,13 +158,28 @@ tab_pre, tab_stat, tab_start, tab_rank, tab_mix_check = st.tabs([
 with tab_pre:
     st.subheader("🎯 事前簡易予想（評価カード）")
 
-    SYMBOL_VALUES = {"◎": 100, "○": 80, "▲": 60, "△": 40, "×": 20, "無": 0}
-    WEIGHTS = {
-        "モーター": 0.25,
-        "当地勝率": 0.2,
-        "枠番勝率": 0.3,
-        "枠番スタート": 0.25
-    }
+    # 当地勝率・枠番勝率・枠番ST は読込済みデータの枠番別成績から自動入力する
+    # （データ版が変わったとき、または再入力ボタンで上書き。それまでは手で変えた記号を保持）
+    AUTO_MARK_KEYS = {"pre_t": "当地勝率", "pre_w": "枠番勝率", "pre_s": "枠番ST"}
+    for prefix in AUTO_MARK_KEYS:
+        for b in range(1, 7):
+            st.session_state.setdefault(f"{prefix}_{b}", NO_MARK)
+
+    pre_ref = st.session_state.get("tab2_data_ref")
+    calib = None
+    if pre_ref is not None:
+        lane_marks = shared_lane_marks(PLACE_NAME, race_type_val, pre_ref["version"])
+        calib = shared_calibration(PLACE_NAME, race_type_val, pre_ref["version"])
+        refill = st.button("🔄 枠番別の成績から再入力", key="pre_autofill_btn")
+        if refill or st.session_state.get("pre_autofill_version") != pre_ref["version"]:
+            for prefix, item in AUTO_MARK_KEYS.items():
+                for b in range(1, 7):
+                    st.session_state[f"{prefix}_{b}"] = lane_marks["marks"][item][b]
+            st.session_state["pre_autofill_version"] = pre_ref["version"]
+        st.caption(
+            f"当地勝率・枠番勝率・枠番ST は直近{RECENT_DAYS}日の枠番別成績から自動入力"
+            f"（{PLACE_NAME}の艇番×月ごとの成績分布の五分位で記号化）"
+        )
 
     with st.form("pre_eval_form"):
         boat_evals = {}
@@ -127,9 +191,9 @@ with tab_pre:
                 with cols[col]:
                     st.markdown(f"#### 🚤 {i}号艇")
                     m = st.selectbox("モーター", ["◎", "○", "▲", "△", "×", "無"], index=5, key=f"pre_m_{i}")
-                    t = st.selectbox("当地勝率", ["◎", "○", "▲", "△", "×", "無"], index=5, key=f"pre_t_{i}")
-                    w = st.selectbox("枠番勝率", ["◎", "○", "▲", "△", "×", "無"], index=5, key=f"pre_w_{i}")
-                    s = st.selectbox("枠番ST", ["◎", "○", "▲", "△", "×", "無"], index=5, key=f"pre_s_{i}")
+                    t = st.selectbox("当地勝率", ["◎", "○", "▲", "△", "×", "無"], key=f"pre_t_{i}")
+                    w = st.selectbox("枠番勝率", ["◎", "○", "▲", "△", "×", "無"], key=f"pre_w_{i}")
+                    s = st.selectbox("枠番ST", ["◎", "○", "▲", "△", "×", "無"], key=f"pre_s_{i}")
 
                     score = (
                         SYMBOL_VALUES[m] * WEIGHTS["モーター"]
@@ -139,6 +203,11 @@ with tab_pre:
                     )
                     boat_evals[i] = round(score, 3)
 
+        # 過去レースでの実際の1着率に合わせて％を補正する（補正マッピングがある場合）
+        pre_calibrate = False
+        if calib is not None and calib["mapping"]:
+            pre_calibrate = st.checkbox("過去の1着実績で予想％を補正（モーターが全艇「無」のとき）", value=True, key="pre_calibrate")
+
         submitted = st.form_submit_button("📊 予想カード生成", use_container_width=True, type="primary")
 
     # 結果表示
@@ -150,8 +219,15 @@ with tab_pre:
         if total_score == 0:
             st.warning("すべて『無』のため、％を計算できません")
         else:
-            # ％正規化
-            df_score["予想％"] = df_score["score"] / total_score * 100
+            # ％正規化（補正ありなら較正マッピングで写してから合計100に戻す）
+            df_score["スコア比％"] = df_score["score"] / total_score * 100
+            df_score["予想％"] = df_score["スコア比％"]
+            # 補正はモーター「無」で再現した予想％に当てはめたものなので、モーター入力時は使わない
+            motor_marked = any(st.session_state[f"pre_m_{b}"] != NO_MARK for b in range(1, 7))
+            if pre_calibrate and motor_marked:
+                st.caption("※ モーターの記号が入っているため、予想％は補正していません")
+            if pre_calibrate and not motor_marked:
+                df_score["予想％"] = recalibrate(df_score["スコア比％"].to_numpy(), calib["mapping"])
             df_score["予想％"] = df_score["予想％"].round(1)
 
             # 並び替えと誤差補正
@@ -184,38 +260,62 @@ with tab_pre:
                         </div>
                     """, unsafe_allow_html=True)
 
+            # 予想％を各艇の強さとみなして、2連単・3連単の確率に展開する
+            pre_probs = race_day_probabilities(df_score.set_index("艇番").sort_index()["予想％"].to_numpy(), beta=None)
+            st.markdown("### 🎲 組番の確率（予想％ベース）")
+            pre_c1, pre_c2 = st.columns(2)
+            pre_c1.dataframe(
+                combo_table(pre_probs, "2連単", top=5).style.format({"確率": "{:.1f}%"}),
+                use_container_width=True, hide_index=True
+            )
+            pre_c2.dataframe(
+                combo_table(pre_probs, "3連単", top=5).style.format({"確率": "{:.1f}%"}),
+                use_container_width=True, hide_index=True
+            )
+
             st.divider()
             st.markdown("### 📋 内訳（デバッグ用）")
-            st.dataframe(df_score[["順位", "艇番", "score", "予想％"]], use_container_width=True, hide_index=True)
+            st.dataframe(
+                df_score[["順位", "艇番", "score", "スコア比％", "予想％"]].round({"スコア比％": 1}),
+                use_container_width=True, hide_index=True
+            )
+
+    # 自動入力の記号を過去の各レースで再現したときの予想％と、実際の1着率の比較
+    if calib is not None and calib["scores"]["races"]:
+        with st.expander("📏 予想％の較正（過去レースでの信頼度）"):
+            st.caption(
+                f"各レースの直前{RECENT_DAYS}日の枠番別成績で記号を付け直して予想％を再現（モーターは「無」）。"
+                "Brier は小さいほど、対数損失は小さいほど良い"
+            )
+            cal_s = calib["scores"]
+            cc1, cc2, cc3 = st.columns(3)
+            cc1.metric("再現レース数", f"{cal_s['races']} R")
+            cc2.metric("Brier", f"{cal_s['brier']:.4f}")
+            cc3.metric("対数損失", f"{cal_s['logloss']:.4f}")
+            if calib["holdout"]:
+                before, after = calib["holdout"]["補正前"], calib["holdout"]["補正後"]
+                st.caption(
+                    f"後半 {before['races']} R での検証（前半で補正を当てはめ）: "
+                    f"Brier {before['brier']:.4f} → {after['brier']:.4f}、"
+                    f"対数損失 {before['logloss']:.4f} → {after['logloss']:.4f}"
+                )
+            st.dataframe(
+                calib["table"].style.format({"平均予想": "{:.1f}%", "実際の1着率": "{:.1f}%"}, na_rep="-"),
+                use_container_width=True, hide_index=True
+            )
 
 # --- タブ2：統計解析 ---
 with tab_stat:
     st.subheader(f"📊 {PLACE_NAME} 補正・総合比較")
 
-    # 1. Google 接続準備（gcの定義） --------------------------------------
-    from google.oauth2.service_account import Credentials
-    import gspread
-
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    
-    try:
-        # secrets から認証情報を取得
-        creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
-        gc = gspread.authorize(creds)
-    except Exception as e:
-        st.error(f"Google接続エラー: {e}")
+    # --- 以降、計算処理（会場DB または 事前集計の艇番別統計を使用） ---
+    lane = get_lane_stats()
+    if lane is None:
+        st.warning("⚠️ データ未読込です。上の読込ボタンでデータを読み込んでください。")
         st.stop()
-    # --------------------------------------------------------------------
-
- 
-    # --- 以降、計算処理 ---
-    place_df = st.session_state["tab2_base_df"].copy()
 
     try:
-        place_mean = place_df.groupby("艇番")[["展示", "直線", "一周", "回り足"]].mean()
-        overall_mean = place_df[["展示", "直線", "一周", "回り足"]].mean()
-        lane_bias = place_mean - overall_mean
-        race_count = len(place_df) // 6
+        race_count = lane["rows"] // 6
         st.caption(f"📊 {PLACE_NAME} ({race_type_val}) 過去約 {race_count} レースより算出")
     except Exception as e:
         st.error(f"計算エラー: シートの列名（展示/直線/一周/回り足）を確認してください。\n{e}")
@@ -262,37 +362,92 @@ with tab_stat:
         st.markdown("#### ① 公式展示タイム表（入力値）")
         st.dataframe(highlight_rank(input_df), use_container_width=True)
 
-        adj_df = input_df.copy()
-        final_df = input_df.copy()
-        
-        for b in range(1, 7):
-            if b in place_mean.index:
-                for col in ["展示", "直線", "一周", "回り足"]:
-                    if pd.notna(input_df.loc[b, col]):
-                        adj_val = input_df.loc[b, col] - place_mean.loc[b, col] + overall_mean[col]
-                        adj_df.loc[b, col] = adj_val
-                        final_df.loc[b, col] = adj_val - lane_bias.loc[b, col]
+        # 各入力値が、この会場・同じ艇番の過去タイムの中でどの位置か（%が小さいほど速い）
+        pct_ref = st.session_state.get("tab2_data_ref")
+        if pct_ref is not None:
+            pct_df = time_percentiles(shared_sorted_times(PLACE_NAME, race_type_val, pct_ref["version"]), input_df)
+            st.markdown("#### ①' 過去タイム内の位置（上位%・同艇番）")
+            def color_pct(v):
+                if pd.isna(v):
+                    return ""
+                return "background-color:#b2f2bb;" if v <= 20 else "background-color:#ffc9c9;" if v >= 80 else ""
+            st.dataframe(
+                pct_df.style.applymap(color_pct).format("上位{:.0f}%", na_rep="-"),
+                use_container_width=True
+            )
+
+        adj_df, final_df = corrected_times(input_df, lane)
 
         st.markdown("#### ② 場平均補正")
         st.dataframe(highlight_rank(adj_df), use_container_width=True)
 
-        st.markdown("#### ③ 枠番補正込み（最終評価）")
-        st.dataframe(highlight_rank(final_df), use_container_width=True)
+        final_col, similar_col = st.columns([3, 2])
+        with final_col:
+            st.markdown("#### ③ 枠番補正込み（最終評価）")
+            st.dataframe(highlight_rank(final_df), use_container_width=True)
+
+        # 入力と似た6艇の並び（艇番別平均との差）だった過去レースと、その着順
+        with similar_col:
+            st.markdown("#### 🔎 類似の過去レース")
+            similar_ref = st.session_state.get("tab2_data_ref")
+            if similar_ref is None:
+                st.caption("データ読込後に表示されます")
+            else:
+                similar_df = nearest_races(shared_similar_index(PLACE_NAME, race_type_val, similar_ref["version"]), input_df)
+                if similar_df.empty:
+                    st.caption("タイムを入力すると表示されます")
+                else:
+                    st.dataframe(similar_df.style.format({"距離": "{:.2f}"}), use_container_width=True, hide_index=True)
+                    win_counts = similar_df["1着艇"].value_counts()
+                    st.caption(
+                        "1着艇: " + " / ".join(f"{b}号艇 {n}回" for b, n in win_counts.items())
+                        + "（未入力の項目は距離に含めない）"
+                    )
+
+        # STEP4 条件補正: 事前集計の条件別キューブから当日の風・波の1セルを参照する（履歴の走査なし）
+        st.markdown("#### ④ 条件補正込み（風・波）")
+        cond_c1, cond_c2, cond_c3 = st.columns(3)
+        wind_dir = cond_c1.selectbox("風向", WIND_DIRS, key="cond_wind_dir")
+        wind_speed = cond_c2.number_input("風速 (m)", min_value=0, max_value=20, value=0, step=1, key="cond_wind_speed")
+        wave_height = cond_c3.number_input("波高 (cm)", min_value=0, max_value=50, value=0, step=1, key="cond_wave")
+
+        cond_ref = st.session_state.get("tab2_data_ref")
+        cond = condition_offsets(
+            PLACE_NAME, race_type_val, cond_ref["version"] if cond_ref else None, wind_dir, wind_speed, wave_height
+        )
+        if cond is None:
+            st.caption("※ 読込中のデータ版の条件補正の集計がありません（データ読込後に python -m core.conditions で作成します）")
+        else:
+            cond_offset, cond_n = cond
+            st.dataframe(highlight_rank(apply_condition_offsets(final_df, cond_offset)), use_container_width=True)
+            st.caption(
+                f"同条件の過去データ: 艇あたり {int(cond_n.min().min())}〜{int(cond_n.max().max())} 件"
+                f"（{MIN_CELL_ROWS}件未満の艇・項目は補正なし）"
+            )
 
 # --- タブ3：スタート予想 ---
 with tab_start:
     st.subheader(f"🚀 スタート予想（{PLACE_NAME} {race_type_val}戦）")
 
     # 1. データの確認
-    if "tab2_base_df" not in st.session_state:
+    lane = get_lane_stats()
+    if lane is None:
         st.warning("「統計解析」タブでデータを読み込んでください。")
         st.stop()
     
-    place_df = st.session_state["tab2_base_df"]
-    mean_tenji = place_df["展示"].mean()
-    mean_isshu = place_df["一周"].mean()
+    overall_mean = lane["overall_mean"]
+    mean_tenji = overall_mean["展示"]
+    mean_isshu = overall_mean["一周"]
+
+    # 会場・種別ごとに探索済みの係数があれば使う（python -m core.optimize で作成）
+    idx_params = load_best_params(PLACE_NAME, race_type_val)
 
     st.caption(f"📊 {PLACE_NAME}平均との比較で算出（平均展示: {mean_tenji:.2f} / 平均一周: {mean_isshu:.2f}）")
+    if idx_params["source"] == "optimized":
+        st.caption(
+            f"⚙️ 最適化係数: 展示×{idx_params['w_tenji']:.2f} / 一周×{idx_params['w_isshu']:.2f}"
+            f"（過去検証 1位的中 {idx_params['hit1']:.1f}% / 上位3艇 {idx_params['hit3']:.1f}%）"
+        )
 
     # 2. 展示・一周データの引き継ぎ（タブ2からの連動）
     # タブ2で入力があればそれを使い、無ければ 0.00 を初期値にする
@@ -321,7 +476,7 @@ with tab_start:
             eval_input[i] = st.selectbox("評価", eval_list, key=f"st_ev_{i}")
 
     # 4. スコア計算
-    eval_map = {"◎": 2.0, "◯": 1.0, "△": 0.5, "×": -1.0}
+    eval_map = idx_params["eval_map"]
     rows = []
     for boat in range(1, 7):
         st_score = -st_input[boat] + eval_map.get(eval_input[boat], 0)
@@ -329,7 +484,7 @@ with tab_start:
         isshu_diff = mean_isshu - isshu_input[boat]
 
         # 指数ロジック
-        total = st_score + (tenji_diff * 2.0) + (isshu_diff * 0.3)
+        total = st_score + (tenji_diff * idx_params["w_tenji"]) + (isshu_diff * idx_params["w_isshu"])
         rows.append({
             "艇番": boat,
             "展示": tenji_input[boat],
@@ -341,10 +496,50 @@ with tab_start:
 
     result_df = pd.DataFrame(rows)
 
+    # 着順確率（Plackett–Luce）。指数の効き具合 β は読込済みデータの過去レースから会場ごとに推定
+    data_ref = st.session_state.get("tab2_data_ref")
+    if data_ref:
+        pl_beta, pl_races, _ = shared_beta(
+            PLACE_NAME, race_type_val, data_ref["version"], mean_tenji, mean_isshu, idx_params
+        )
+    else:
+        pl_beta, pl_races = DEFAULT_BETA, 0
+    start_probs = race_day_probabilities(result_df["start_score"].to_numpy(), pl_beta)
+    result_df["1着確率(%)"] = (start_probs["単勝"][0] * 100).round(1)
+
     # 5. 表の表示
     st.markdown("### 📊 スタート指数ランキング")
     st.dataframe(result_df.sort_values("start_score", ascending=False), use_container_width=True, hide_index=True)
 
+    st.markdown("### 🎲 2連単・3連単 確率上位")
+    prob_c1, prob_c2 = st.columns(2)
+    prob_c1.dataframe(
+        combo_table(start_probs, "2連単").style.format({"確率": "{:.1f}%"}),
+        use_container_width=True, hide_index=True
+    )
+    prob_c2.dataframe(
+        combo_table(start_probs, "3連単").style.format({"確率": "{:.2f}%"}),
+        use_container_width=True, hide_index=True
+    )
+    if pl_races:
+        st.caption(f"β = {pl_beta:.2f}（{PLACE_NAME}の過去 {pl_races} レースの1〜3着から推定）")
+    else:
+        st.caption(f"β = {pl_beta:.2f}（データ未読込のため未校正）")
+
+    # 着順シミュレーション（当日の入力 ± 会場・艇番ごとの過去のばらつき、乱数は固定シード）
+    if data_ref:
+        sim_sigma = score_spread(shared_lane_spread(PLACE_NAME, race_type_val, data_ref["version"]), idx_params)
+        sim = cached_simulation(
+            tuple(tenji_input.values()), tuple(isshu_input.values()), tuple(st_input.values()),
+            tuple(eval_input.values()), float(mean_tenji), float(mean_isshu), idx_params, tuple(sim_sigma),
+        )
+        st.markdown(f"### 🎰 着順シミュレーション（{sim['n'] // 10000}万レース）")
+        sim_c1, sim_c2 = st.columns([3, 2])
+        sim_c1.dataframe(finish_table(sim).style.format({"1着率": "{:.1f}%", "2着内率": "{:.1f}%", "3着内率": "{:.1f}%"}),
+                         use_container_width=True, hide_index=True)
+        sim_c2.dataframe(combo_table({"3連単": sim["3連単"][None, :]}, "3連単", top=6).style.format({"確率": "{:.2f}%"}),
+                         use_container_width=True, hide_index=True)
+
     # 6. スリット表示（画像変換関数が必要）
     def encode_image(path):
         if os.path.exists(path):
@@ -391,25 +586,16 @@ with tab_rank:
     st.subheader(f"🏆 {PLACE_NAME} 補正後ランキング分析")
 
     # 1. データの確認
-    if "tab2_input_df" not in st.session_state or "tab2_base_df" not in st.session_state:
+    lane = get_lane_stats()
+    if "tab2_input_df" not in st.session_state or lane is None:
         st.info("「統計解析」タブでデータの読み込みとタイム入力を行ってください。")
         st.stop()
     
     input_df = st.session_state["tab2_input_df"].copy()
-    place_df = st.session_state["tab2_base_df"]
 
     # 2. 補正計算ロジック
     items = ["展示", "直線", "一周", "回り足"]
-    place_mean = place_df.groupby("艇番")[items].mean()
-    overall_mean = place_df[items].mean()
-    lane_bias = place_mean - overall_mean
-
-    final_adj_df = input_df.copy()
-    for b in range(1, 7):
-        if b in place_mean.index:
-            for col in items:
-                adj_val = input_df.loc[b, col] - place_mean.loc[b, col] + overall_mean[col]
-                final_adj_df.loc[b, col] = adj_val - lane_bias.loc[b, col]
+    _, final_adj_df = corrected_times(input_df, lane)
 
     # 3. 順位の算出
     raw_rank = input_df[items].rank(method="min")
@@ -481,102 +667,117 @@ with tab_rank:
         summary_table.style.applymap(color_official_style, subset=["展示", "直線", "一周", "回り足"]).format("{:.1f}"),
         use_container_width=True
     )
+
+    # 6. 補正後タイムでの着順シミュレーション（ST・評価は「スタート予想」タブの入力を使用）
+    rank_ref = st.session_state.get("tab2_data_ref")
+    if rank_ref:
+        rank_params = load_best_params(PLACE_NAME, race_type_val)
+        rank_sim = cached_simulation(
+            tuple(final_adj_df["展示"].reindex(range(1, 7)).tolist()),
+            tuple(final_adj_df["一周"].reindex(range(1, 7)).tolist()),
+            tuple(float(st.session_state.get(f"st_st_{b}", 0.0)) for b in range(1, 7)),
+            tuple(st.session_state.get(f"st_ev_{b}", "") for b in range(1, 7)),
+            float(lane["overall_mean"]["展示"]), float(lane["overall_mean"]["一周"]), rank_params,
+            tuple(score_spread(shared_lane_spread(PLACE_NAME, race_type_val, rank_ref["version"]), rank_params)),
+        )
+        st.markdown("### 🎰 補正後タイムでの着順シミュレーション")
+        st.dataframe(
+            finish_table(rank_sim).style.format({"1着率": "{:.1f}%", "2着内率": "{:.1f}%", "3着内率": "{:.1f}%"}),
+            use_container_width=True, hide_index=True
+        )
 with tab_mix_check:
     st.subheader(f"📊 {PLACE_NAME}｜スタート指数 精度検証")
 
     # 1. データの確認（タブ2で読み込んだデータを使用）
-    if "tab2_base_df" not in st.session_state:
+    if "tab2_data_ref" not in st.session_state:
         st.info("「統計解析」タブで統計データを読み込んでから検証を開始してください。")
         st.stop()
     
-    # 統計データをコピーして使用
-    df = st.session_state["tab2_base_df"].copy()
-
-    # 必須列のチェック（着順など検証に必要な列があるか）
-    need_cols = ["日付", "レース番号", "艇番", "展示", "一周", "ST", "着順"]
-    # 統計シートに「着順」がない場合を想定したガード
-    if "着順" not in df.columns:
-        st.error("統計シートに『着順』列がないため、的中率を計算できません。シートを確認してください。")
-        st.stop()
-
-    # 型変換
-    for c in ["艇番", "展示", "一周", "ST", "着順"]:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
+    # 検証対象は会場DBの完走レース（統計シートに「着順」がない場合は0件になり、下の警告で止まる）
+    data_version = st.session_state["tab2_data_ref"]["version"]
 
     # 2. スタート指数の再計算ロジック
-    # (※評価データが統計シートにある場合のみ加味。ない場合は0として計算)
-    eval_col = "スタート評価" if "スタート評価" in df.columns else "評価"
-    eval_map = {"◎": 2.0, "◯": 1.0, "△": 0.5, "×": -1.0}
-    
-    if eval_col in df.columns:
-        df["評価補正"] = df[eval_col].map(eval_map).fillna(0)
-    else:
-        df["評価補正"] = 0
-
-    # 会場平均の算出
-    mean_tenji = df["展示"].mean()
-    mean_isshu = df["一周"].mean()
-
-    # 指数計算
-    df["指数"] = (
-        -df["ST"].fillna(0)
-        + df["評価補正"]
-        + (mean_tenji - df["展示"]) * 2.0
-        + (mean_isshu - df["一周"]) * 0.3
-    )
+    # (※評価データ（スタート評価 / 評価）が統計シートにある場合のみ加味。ない場合は0として計算)
+    # 会場平均の算出（会場DBの全履歴）
+    overall_mean = get_lane_stats()["overall_mean"]
+    mean_tenji = overall_mean["展示"]
+    mean_isshu = overall_mean["一周"]
+
+    # ウォークフォワード: 各開催日の指数係数を、その前日までの直近N日のレースだけでグリッドから選び直して評価する
+    # （係数選びに当日以降のレースを使わない。会場平均は6艇に同じ量を足すだけなので順位には効かない）
+    wf_col1, wf_col2 = st.columns([2, 1])
+    with wf_col1:
+        check_mode = st.radio(
+            "検証方式", ["全期間", "ウォークフォワード（直近N日で係数を選び直す）"], horizontal=True, key="mix_check_mode"
+        )
+    with wf_col2:
+        window_days = st.number_input(
+            "N（日）", min_value=7, max_value=3650, value=180, step=30, key="mix_check_window",
+            disabled=check_mode == "全期間",
+        )
+    window_days = int(window_days) if check_mode != "全期間" else None
 
-    # 3. レース単位で集計（的中判定）
-    results = []
-    # 日付とレース番号でグループ化
-    for (d, r), g in df.groupby(["日付", "レース番号"]):
-        if len(g) < 6: continue # 6艇揃っていないレースは除外
-
-        # 指数上位3艇を抽出
-        g_sorted = g.sort_values("指数", ascending=False)
-        top1 = int(g_sorted.iloc[0]["艇番"])
-        top2 = int(g_sorted.iloc[1]["艇番"])
-        top3 = int(g_sorted.iloc[2]["艇番"])
-
-        # 実際の着順を取得
-        winner_row = g[g["着順"] == 1]
-        if winner_row.empty: continue
-        
-        winner = int(winner_row.iloc[0]["艇番"])
-        
-        # 的中判定
-        results.append({
-            "日付": d,
-            "R": r,
-            "指数1位": top1,
-            "指数2位": top2,
-            "指数3位": top3,
-            "1着艇": winner,
-            "1位的中": (top1 == winner),
-            "上位2艇内": (winner in [top1, top2]),
-            "上位3艇内": (winner in [top1, top2, top3])
-        })
+    # 3. 指数計算と的中判定（全レースを NumPy で一括判定）
+    # データ版・会場平均・指数係数が同じなら前回の結果を使う（メモリ＋ディスクのキャッシュ）
+    idx_params = load_best_params(PLACE_NAME, race_type_val)
+
+    def load_race_matrix():
+        # キャッシュが無いときだけ (レース数 × 6艇) の配列を組み立てる（プロセス共有・データ版ごとに1回）
+        return shared_race_matrix(PLACE_NAME, race_type_val, data_version)
+
+    bt = cached_backtest(
+        PLACE_NAME, race_type_val, data_version, mean_tenji, mean_isshu, idx_params, load_race_matrix, window_days
+    )
+    res_df = bt["results"]
+    if not window_days and idx_params["source"] == "optimized":
+        st.caption("※ 指数係数は同じ履歴で最適化したもの。以下の的中率は学習データ内の値で、実際より高めに出ます")
 
-    if not results:
+    if res_df.empty:
         st.warning("検証可能なレースデータ（6艇揃っており着順があるデータ）がありません。")
         st.stop()
-
-    res_df = pd.DataFrame(results)
+    if window_days:
+        st.caption(
+            f"※ 直前{window_days}日間の完走レースが{WALK_FORWARD_MIN_RACES}R未満の日（データの立ち上がり期間）は検証対象外。"
+            f"指数係数は各日の直前{window_days}日のレースで選び直した値"
+        )
 
     # 4. サマリー表示
-    total = len(res_df)
-    hit1 = res_df["1位的中"].mean() * 100
-    hit2 = res_df["上位2艇内"].mean() * 100
-    hit3 = res_df["上位3艇内"].mean() * 100
+    summary = bt["summary"]
+    total = summary["races"]
+    hit1 = summary["hit1"]
+    hit2 = summary["hit2"]
+    hit3 = summary["hit3"]
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("検証レース数", f"{total} R")
     c2.metric("指数1位的中率", f"{hit1:.1f}%")
     c3.metric("上位2艇 1着率", f"{hit2:.1f}%")
     c4.metric("上位3艇 1着率", f"{hit3:.1f}%")
+    # 信頼区間はレース単位のブートストラップ（バックテストと一緒にキャッシュ済み）
+    ci = summary["ci"]
+    for col, key in ((c2, "hit1"), (c3, "hit2"), (c4, "hit3")):
+        col.caption(f"{summary['ci_level'] * 100:.0f}%区間 {ci[key][0]:.1f}〜{ci[key][1]:.1f}%")
+
+    st.divider()
+
+    # 5. 2連単・3連単の買い目別検証（指数順位から組番を作り、全30/120通りを一括判定）
+    combo_df = cached_combo_backtest(
+        PLACE_NAME, race_type_val, data_version, mean_tenji, mean_isshu, idx_params, load_race_matrix, window_days
+    )["results"]
+
+    st.markdown("### 🎯 2連単・3連単 買い目別検証")
+    st.caption("買い目の数字は指数の順位（1 = 指数1位の艇）。回収率は各点100円均等買いで計算")
+    if combo_df["回収率"].isna().all():
+        st.caption("※ 統計シートに「2連単配当」「3連単配当」列がないため、回収率は表示されません。")
+    st.dataframe(
+        combo_df.style.format({"的中率": "{:.1f}%", "回収率": "{:.1f}%", "平均配当": "{:,.0f}円"}, na_rep="-"),
+        use_container_width=True,
+        hide_index=True
+    )
 
     st.divider()
 
-    # 5. 詳細データ表示（色付け）
+    # 6. 詳細データ表示（色付け）
     def color_hit(val):
         return 'background-color: #d4edda' if val else ''
 
@@ -1,9 +1,13 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import requests
 import plotly.express as px
 import streamlit.components.v1 as components
+import datetime
+
+from core.gas import StaleWhileRevalidate, resolve_gas_url
+from core.plackett_luce import combo_table, race_day_probabilities
+from core.store import venue_summary
 
 # ==========================================
 # 1. 基本設定とデータソース (GAS連携)
@@ -16,56 +20,21 @@ GAS_URL = "https://script.google.com/macros/s/AKfycbwypoD8dV1DhXsX6C1wK893MAWKIm
 # ==========================================
 # 2. 高速解析エンジン (GAS JSON読込)
 # ==========================================
-@st.cache_data(ttl=3600)
+@st.cache_resource
+def get_stats_source():
+    # プロセス共有。期限切れでも最後の集計結果を即座に返し、裏で取り直す
+    return StaleWhileRevalidate(resolve_gas_url(GAS_URL), ttl=3600)
+
 def load_all_stats_from_gas():
-    stats = {}
     try:
-        # GASから全シートのデータを一括取得
-        response = requests.get(GAS_URL)
-        all_data = response.json()
-        
-        for sheet_name, rows in all_data.items():
-            if len(rows) < 2: continue
-            
-            # 会場名の整形 (例: 桐生_混合統計 -> 桐生)
-            place = sheet_name.replace("_混合統計", "").strip()
-            
-            # DataFrame化 (1行目はヘッダー)
-            df = pd.DataFrame(rows[1:], columns=rows[0])
-            
-            # 列名の空白削除
-            df.columns = df.columns.str.strip()
-            
-            # 数値変換 (エラーはNaNにして除外)
-            df['着順_num'] = pd.to_numeric(df['着順'], errors='coerce')
-            df['展示_num'] = pd.to_numeric(df['展示'], errors='coerce')
-            df = df.dropna(subset=['着順_num', '展示_num'])
-            
-            if df.empty: continue
-            
-            # 展示順位の計算 (レースごとにグループ化)
-            # ※日付、レース番号、会場名が一致するものを1レースとする
-            df['展示順位'] = df.groupby(['日付', 'レース番号'])['展示_num'].rank(method='min')
-            
-            # 統計指標の算出
-            top_ex = df[df['展示順位'] == 1]
-            win_rate = (top_ex['着順_num'] == 1).mean() * 100 if not top_ex.empty else 35.0
-            show_rate = (top_ex['着順_num'] <= 3).mean() * 100 if not top_ex.empty else 65.0
-            in_nige = (df[df['艇番'] == 1]['着順_num'] == 1).mean() * 100 if not df[df['艇番'] == 1].empty else 50.0
-            
-            stats[place] = {
-                "展示信頼度": round(win_rate, 1), # 展示1位が1着をとる確率
-                "展示貢献度": round(show_rate, 1), # 展示1位が3着以内に入る確率
-                "イン逃げ率": round(in_nige, 1),
-                "サンプル数": len(df)
-            }
-        return stats
+        return get_stats_source().get()
     except Exception as e:
         st.error(f"データ連携エラー: {e}")
-        return {}
+        return {"stats": {}, "as_of": None}
 
 # データの読み込み
-ACTUAL_STATS = load_all_stats_from_gas()
+STATS_SNAPSHOT = load_all_stats_from_gas()
+ACTUAL_STATS = STATS_SNAPSHOT["stats"]
 
 # ==========================================
 # 3. デザイン共通設定
@@ -92,6 +61,8 @@ with st.sidebar:
         st.metric("展示1位の1着率", f"{p_stat['展示信頼度']}%")
         st.metric("展示1位の3連対率", f"{p_stat['展示貢献度']}%")
         st.caption(f"分析対象: {p_stat['サンプル数']} レース分")
+        as_of = datetime.datetime.fromtimestamp(STATS_SNAPSHOT["as_of"])
+        st.caption(f"🕒 データ時点: {as_of:%Y/%m/%d %H:%M}")
     else:
         st.warning("GASからのデータ読込を待機中...")
     
@@ -152,11 +123,24 @@ if ACTUAL_STATS:
                 top_3 = df_res["艇番"].tolist()[:3]
                 st.info(f"💡 推奨買い目: {top_3[0]} - {top_3[1]} - {top_3[2]} (実績期待値ベース)")
 
+                # 期待値（スコア比）を強さとして 2連単・3連単の確率に展開（Plackett–Luce）
+                probs = race_day_probabilities(df_res.set_index("艇番").sort_index()["score"].to_numpy(), beta=None)
+                pc1, pc2 = st.columns(2)
+                pc1.markdown("**2連単 確率上位**")
+                pc1.dataframe(combo_table(probs, "2連単", top=5).round(1), use_container_width=True, hide_index=True)
+                pc2.markdown("**3連単 確率上位**")
+                pc2.dataframe(combo_table(probs, "3連単", top=5).round(2), use_container_width=True, hide_index=True)
+
     with tab2:
         st.subheader("全国24場 データ比較")
-        # 全会場の統計をテーブルで表示
-        compare_df = pd.DataFrame.from_dict(ACTUAL_STATS, orient='index').reset_index()
-        compare_df.columns = ["会場名", "展示信頼度", "展示貢献度", "イン逃げ率", "サンプル数"]
+        # 全会場の統計をテーブルで表示（会場DBに取り込み済みの会場は索引付きクエリで集計し、
+        # まだ取り込んでいない会場は GAS の集計を使う。一部の会場だけが表に残らないように会場ごとに合わせる）
+        gas_df = pd.DataFrame.from_dict(ACTUAL_STATS, orient='index').reset_index()
+        gas_df.columns = ["会場名", "展示信頼度", "展示貢献度", "イン逃げ率", "サンプル数"]
+        store_df = venue_summary()
+        compare_df = pd.concat(
+            [store_df, gas_df[~gas_df["会場名"].isin(store_df["会場名"])]], ignore_index=True
+        )
         st.dataframe(compare_df.sort_values("イン逃げ率", ascending=False), use_container_width=True, hide_index=True)
 
 else:
@@ -1,24 +1,23 @@
 import streamlit as st
 import pandas as pd
 import os
-import gspread
-from google.oauth2.service_account import Credentials
+from core.backtest import CI_LEVEL
+from core.backtest_cache import venue_backtests
+from core.prefetch import start_prefetch_scheduler
+from core.sheets import SHEET_KEY_EAST, get_gspread_client, get_worksheet
 
 # --- 1. ページ初期設定 ---
 st.set_page_config(page_title="競艇予想Pro - Premium", layout="wide")
 
-# Google Sheets 認証用関数
-@st.cache_resource
-def get_gspread_client():
-    try:
-        scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-        creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scope)
-        return gspread.authorize(creds)
-    except Exception:
-        return None
+# クライアントの初期化（会場ページと同じプロセス共有クライアント）
+try:
+    gc = get_gspread_client()
+except Exception:
+    gc = None
 
-# クライアントの初期化
-gc = get_gspread_client()
+# 全会場シートの先読みをバックグラウンドで開始（プロセスで1回だけ）
+if gc:
+    start_prefetch_scheduler()
 
 # --- 2. 会場リスト（ナビゲーションとボタン共通） ---
 all_venues = [
@@ -63,8 +62,7 @@ def show_main_page():
     st.markdown("### 💎 本日のプレミアム・ガイド")
     if gc:
         try:
-            sh = gc.open_by_key("1lN794iGtyGV2jNwlYzUA8wEbhRwhPM7FxDAkMaoJss4")
-            ws_guide = sh.worksheet("ガイド枠")
+            ws_guide = get_worksheet(SHEET_KEY_EAST, "ガイド枠")
             guide_df = pd.DataFrame(ws_guide.get_all_records())
             if not guide_df.empty:
                 g_cols = st.columns(len(guide_df))
@@ -209,6 +207,40 @@ def show_main_page():
         st.subheader("📱 公式リンク")
         st.link_button("公式X (@bort_strike) をフォロー", "https://x.com/bort_strike", use_container_width=True)
 
+    with tab4:
+        st.subheader("📈 スタート指数の的中実績（会場別）")
+        hit_type = st.radio("種別", ["混合", "女子"], horizontal=True, key="home_hit_type")
+        with st.spinner("会場ごとの検証結果を集計中..."):
+            hit_summary = venue_backtests(hit_type)
+        hit_rows = []
+        for place, s in hit_summary.items():
+            if not s.get("races"):
+                continue
+            ci = s["ci"]
+            hit_rows.append({
+                "会場": place,
+                "検証レース数": s["races"],
+                "指数1位的中率": s["hit1"],
+                "1位 区間": f"{ci['hit1'][0]:.1f}〜{ci['hit1'][1]:.1f}%",
+                "上位2艇 1着率": s["hit2"],
+                "上位2艇 区間": f"{ci['hit2'][0]:.1f}〜{ci['hit2'][1]:.1f}%",
+                "上位3艇 1着率": s["hit3"],
+                "上位3艇 区間": f"{ci['hit3'][0]:.1f}〜{ci['hit3'][1]:.1f}%",
+            })
+        if not hit_rows:
+            st.info("🌙 会場データの読込後に表示されます。")
+        else:
+            st.dataframe(
+                pd.DataFrame(hit_rows).style.format({
+                    "指数1位的中率": "{:.1f}%", "上位2艇 1着率": "{:.1f}%", "上位3艇 1着率": "{:.1f}%"
+                }),
+                use_container_width=True, hide_index=True
+            )
+            st.caption(
+                f"会場DBの完走レースを全期間平均・既定の指数係数で再判定した結果。区間はレースを復元抽出して求めた{CI_LEVEL * 100:.0f}%信頼区間で、"
+                "レース数が少ない会場ほど幅が広くなります"
+            )
+
 # --- 4. ナビゲーションの設定 ---
 home_page = st.Page(show_main_page, title="ホーム", icon="🏠", default=True)
 
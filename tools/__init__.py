@@ -0,0 +1 @@
+# 開発・計測用のスクリプト
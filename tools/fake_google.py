@@ -0,0 +1,323 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import pathlib
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+
+# ==========================================
+# Google Sheets / GAS のローカル代替サーバー（負荷試験・計測用）
+# ==========================================
+# 起動例:
+#   python -m tools.fake_google --races 4000 --latency 0.3 --quota-rate 0.05
+#   BOAT_FAKE_GOOGLE=http://127.0.0.1:8765 streamlit run public_app.py
+#
+# 提供するエンドポイント（アプリが使う部分だけ）:
+#   GET /v4/spreadsheets/{key}                      シート一覧（メタデータ）
+#   GET /v4/spreadsheets/{key}/values/{range}       値の取得
+#   GET /v4/spreadsheets/{key}/values:batchGet      値の一括取得
+#   GET /gas                                        GAS と同じ {シート名: 行リスト} の JSON
+from core.sheets import SHEET_KEY_EAST, VENUE_SHEET_KEYS
+
+HEADER = ["日付", "レース番号", "艇番", "展示", "直線", "一周", "回り足", "ST", "着順", "評価", "2連単配当", "3連単配当",
+          "風向", "風速", "波高"]
+EVAL_SYMBOLS = ["", "", "", "◎", "◯", "△", "×"]
+WIND_DIRS = ["北", "北東", "東", "南東", "南", "南西", "西", "北西"]
+# トップページのガイド枠（public_app は get_all_records で読む）。信頼度は S / A / それ以外 で色が変わる
+GUIDE_ROWS = [
+    ["会場", "レース番号", "信頼度", "コメント", "ページパス"],
+    ["桐生", "12R", "S", "1号艇の展示・一周がともに上位。イン逃げ本線。", "pages/01_kiryu.py"],
+    ["住之江", "10R", "A", "向かい風で外枠の一周が落ちる条件。内寄りから。", "pages/12_suminoe.py"],
+    ["大村", "8R", "B", "スタート展示がばらついた一戦。3連単は手広く。", "pages/24_omura.py"],
+]
+
+
+def synth_sheet(place, race_type, races, seed):
+    # 枠番ごとの傾向を持たせた、それらしいレース履歴を作る
+    rng = np.random.default_rng(int(hashlib.sha1(f"{place}{race_type}{seed}".encode()).hexdigest()[:8], 16))
+    lane = np.arange(1, 7)
+    rows = [HEADER]
+    day0 = np.datetime64("2022-01-01")
+    for n in range(races):
+        day = str(day0 + n // 12).replace("-", "/")
+        # 風・波はレース単位。向かい風（ここでは北寄り）が強いほど外枠の一周・回り足が遅くなる
+        wind_dir = WIND_DIRS[rng.integers(len(WIND_DIRS))]
+        wind = int(min(rng.gamma(2.0, 1.5), 12))
+        wave = int(min(wind * 1.5 + rng.gamma(1.5, 1.5), 25))
+        head = wind * (1 if wind_dir in ("北", "北東", "北西") else 0)
+        tenji = 6.70 + lane * 0.01 + wave * 0.004 + rng.normal(0, 0.06, 6)
+        choku = 7.00 + lane * 0.01 + head * 0.01 + rng.normal(0, 0.08, 6)
+        isshu = 37.40 + lane * 0.05 + head * lane * 0.02 + rng.normal(0, 0.30, 6)
+        mawari = 5.20 + lane * 0.02 + head * lane * 0.006 + rng.normal(0, 0.10, 6)
+        st_ = np.clip(0.15 + rng.normal(0, 0.05, 6), 0.01, 0.40)
+        base = -tenji * 8 - st_ * 10 - lane * 0.35
+        strength = base + rng.gumbel(0, 1, 6)
+        order = np.empty(6, dtype=int)
+        order[np.argsort(-strength)] = lane
+        # Gumbel ノイズなので着順は base を重みとする Plackett–Luce に従う。
+        # 払戻は的中組番の確率から控除率 25% で決める（10円単位、最低100円）
+        w = np.exp(base - base.max())
+        top3 = np.argsort(order)[:3]
+        p1 = w[top3[0]] / w.sum()
+        p2 = p1 * w[top3[1]] / (w.sum() - w[top3[0]])
+        p3 = p2 * w[top3[2]] / (w.sum() - w[top3[0]] - w[top3[1]])
+        pay2, pay3 = (max(100, int(round(75 / p / 10)) * 10) for p in (p2, p3))
+        for i in range(6):
+            rows.append([
+                day, str(n % 12 + 1), str(i + 1),
+                f"{tenji[i]:.2f}", f"{choku[i]:.2f}", f"{isshu[i]:.2f}", f"{mawari[i]:.2f}",
+                f"{st_[i]:.2f}", str(order[i]), EVAL_SYMBOLS[rng.integers(len(EVAL_SYMBOLS))],
+                str(pay2), str(pay3), wind_dir, f"{wind}m", f"{wave}cm",
+            ])
+    return rows
+
+
+def load_fixtures(root):
+    # root/{スプレッドシートキー}/{シート名}.csv を読み込む
+    books = {}
+    for path in sorted(pathlib.Path(root).glob("*/*.csv")):
+        with open(path, encoding="utf-8", newline="") as f:
+            books.setdefault(path.parent.name, {})[path.stem] = [row for row in csv.reader(f)]
+    return books
+
+
+def synth_books(races, seed):
+    books = {}
+    for place, key in VENUE_SHEET_KEYS.items():
+        for race_type in ["混合", "女子"]:
+            n = races if race_type == "混合" else max(races // 4, 1)
+            books.setdefault(key, {})[f"{place}_{race_type}統計"] = synth_sheet(place, race_type, n, seed)
+    books.setdefault(SHEET_KEY_EAST, {})["ガイド枠"] = [list(r) for r in GUIDE_ROWS]
+    return books
+
+
+def dump_books(books, root):
+    for key, sheets in books.items():
+        d = pathlib.Path(root) / key
+        d.mkdir(parents=True, exist_ok=True)
+        for title, rows in sheets.items():
+            with open(d / f"{title}.csv", "w", encoding="utf-8", newline="") as f:
+                csv.writer(f).writerows(rows)
+
+
+_A1 = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+def _split_range(range_name):
+    # "'桐生_混合統計'!A25:ZZ" -> ("桐生_混合統計", "A25:ZZ")
+    if "!" not in range_name:
+        return range_name.strip("'"), ""
+    title, cells = range_name.rsplit("!", 1)
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, cells
+
+
+def slice_values(rows, cells):
+    m = _A1.match(cells.upper()) if cells else None
+    if not m:
+        return [list(r) for r in rows]
+    c1, r1, c2, r2 = m.groups()
+    # "A5:ZZ" のように終端行が無い場合は最終行まで
+    top = int(r1) if r1 else 1
+    bottom = int(r2) if r2 else (top if r1 and m.group(3) is None else len(rows))
+    left = _col_index(c1) if c1 else 1
+    right = _col_index(c2) if c2 else (left if c1 and m.group(3) is None else 10 ** 6)
+    out = []
+    for row in rows[top - 1:bottom]:
+        part = row[left - 1:right]
+        # Sheets API と同じく末尾の空セルは返さない
+        while part and part[-1] == "":
+            part = part[:-1]
+        out.append(part)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+class FakeGoogle:
+    def __init__(self, books, latency=0.0, jitter=0.0, quota_rate=0.0, quota_every=0, gzip_min=1024, seed=0):
+        self.books = books
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_rate = quota_rate
+        self.quota_every = quota_every
+        self.gzip_min = gzip_min
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._gas_body = None
+
+    def wait(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def quota_exceeded(self):
+        with self._lock:
+            self.requests += 1
+            n = self.requests
+            hit = self._rng.random() < self.quota_rate
+        return hit or (self.quota_every and n % self.quota_every == 0)
+
+    def metadata(self, key):
+        sheets = self.books.get(key)
+        if sheets is None:
+            return None
+        return {
+            "spreadsheetId": key,
+            "properties": {"title": key, "locale": "ja_JP", "timeZone": "Asia/Tokyo"},
+            "sheets": [
+                {"properties": {
+                    "sheetId": i, "title": title, "index": i, "sheetType": "GRID",
+                    "gridProperties": {"rowCount": len(rows), "columnCount": max(len(r) for r in rows)},
+                }}
+                for i, (title, rows) in enumerate(sheets.items())
+            ],
+        }
+
+    def values(self, key, range_name):
+        title, cells = _split_range(range_name)
+        rows = self.books.get(key, {}).get(title)
+        if rows is None:
+            return None
+        return {"range": range_name, "majorDimension": "ROWS", "values": slice_values(rows, cells)}
+
+    def gas_body(self):
+        # GAS は混合統計シートをまとめて返す
+        if self._gas_body is None:
+            data = {t: rows for sheets in self.books.values() for t, rows in sheets.items() if t.endswith("_混合統計")}
+            self._gas_body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return self._gas_body
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, headers=None):
+            headers = dict(headers or {})
+            if len(body) >= fake.gzip_min and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status, obj, headers=None):
+            self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), headers)
+
+        def _error(self, code, status, message):
+            self._json(code, {"error": {"code": code, "message": message, "status": status}})
+
+        def do_GET(self):
+            fake.wait()
+            url = urlparse(self.path)
+            parts = [unquote(p) for p in url.path.split("/") if p]
+
+            if parts == ["gas"]:
+                body = fake.gas_body()
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self._send(200, body, {"ETag": etag})
+                return
+
+            if len(parts) < 3 or parts[:2] != ["v4", "spreadsheets"]:
+                self._error(404, "NOT_FOUND", "Requested entity was not found.")
+                return
+            if fake.quota_exceeded():
+                self._error(429, "RESOURCE_EXHAUSTED", "Quota exceeded for quota metric 'Read requests'.")
+                return
+
+            key = parts[2]
+            query = parse_qs(url.query)
+            if len(parts) == 3:
+                meta = fake.metadata(key)
+                if meta is None:
+                    self._error(404, "NOT_FOUND", "Requested entity was not found.")
+                else:
+                    self._json(200, meta)
+                return
+
+            if len(parts) == 4 and parts[3] == "values:batchGet":
+                ranges = []
+                for r in query.get("ranges", []):
+                    vr = fake.values(key, r)
+                    if vr is None:
+                        self._error(400, "INVALID_ARGUMENT", f"Unable to parse range: {r}")
+                        return
+                    ranges.append(vr)
+                self._json(200, {"spreadsheetId": key, "valueRanges": ranges})
+                return
+
+            if len(parts) == 5 and parts[3] == "values":
+                vr = fake.values(key, parts[4])
+                if vr is None:
+                    self._error(400, "INVALID_ARGUMENT", f"Unable to parse range: {parts[4]}")
+                else:
+                    self._json(200, vr)
+                return
+
+            self._error(404, "NOT_FOUND", "Requested entity was not found.")
+
+        def log_message(self, fmt, *args):
+            if self.server.verbose:
+                sys.stderr.write("%s - %s\n" % (self.address_string(), fmt % args))
+
+    return Handler
+
+
+def serve(fake, host="127.0.0.1", port=8765, verbose=False):
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Google Sheets / GAS のローカル代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", help="{キー}/{シート名}.csv 形式のフィクスチャディレクトリ")
+    parser.add_argument("--races", type=int, default=4000, help="フィクスチャ未指定時に生成する1シートあたりのレース数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dump", help="生成したフィクスチャをこのディレクトリに書き出して終了")
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のばらつき（±秒）")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="429 を返す確率")
+    parser.add_argument("--quota-every", type=int, default=0, help="N 回に1回 429 を返す")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    books = load_fixtures(args.fixtures) if args.fixtures else synth_books(args.races, args.seed)
+    if args.dump:
+        dump_books(books, args.dump)
+        sys.exit(0)
+
+    fake = FakeGoogle(books, args.latency, args.jitter, args.quota_rate, args.quota_every, seed=args.seed)
+    server = serve(fake, args.host, args.port, args.verbose)
+    print(f"fake google: http://{args.host}:{args.port}  ({sum(len(s) for s in books.values())} sheets)")
+    server.serve_forever()